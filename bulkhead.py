@@ -0,0 +1,87 @@
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from metrics import BULKHEAD_IN_FLIGHT, BULKHEAD_QUEUE_DEPTH, BULKHEAD_WAIT_SECONDS, BULKHEAD_REJECTED
+import asyncio
+import time
+
+
+class BulkheadFullError(HTTPException):
+    def __init__(self, name: str, reason: str):
+        super().__init__(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail = f'Service {name} is overloaded'
+        )
+        self.name = name
+        self.reason = reason
+
+
+class Bulkhead:
+    """
+    Переборка на один нижестоящий сервис.
+
+    Не больше max_concurrent вызовов одновременно, не больше max_queue в очереди
+    на слот. Ждать слот можно не дольше queue_timeout секунд, иначе - отказ.
+    Так медленный сервис выедает только свои слоты, а не весь event loop и сокеты.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int = 50,
+        max_queue: int = 100,
+        queue_timeout: float = 1.0
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.queued = 0
+
+        self._in_flight_gauge = BULKHEAD_IN_FLIGHT.labels(name)
+        self._queue_gauge = BULKHEAD_QUEUE_DEPTH.labels(name)
+        self._wait_histogram = BULKHEAD_WAIT_SECONDS.labels(name)
+
+    def _reject(
+        self,
+        reason: str
+    ):
+        BULKHEAD_REJECTED.labels(self.name, reason).inc()
+        raise BulkheadFullError(self.name, reason)
+
+    @asynccontextmanager
+    async def acquire(
+        self,
+        timeout: float | None = None
+    ):
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                self._reject('queue_full')
+
+            self.queued += 1
+            self._queue_gauge.set(self.queued)
+            start = time.monotonic()
+            try:
+                queue_timeout = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+                async with asyncio.timeout(queue_timeout):
+                    await self._semaphore.acquire()
+            except TimeoutError:
+                self._reject('queue_timeout')
+            finally:
+                self.queued -= 1
+                self._queue_gauge.set(self.queued)
+                self._wait_histogram.observe(time.monotonic() - start)
+        else:
+            await self._semaphore.acquire()
+            self._wait_histogram.observe(0.0)
+
+        self.in_flight += 1
+        self._in_flight_gauge.set(self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._in_flight_gauge.set(self.in_flight)
+            self._semaphore.release()
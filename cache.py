@@ -0,0 +1,113 @@
+from collections import OrderedDict
+import sys
+import time
+
+
+class TTLCache:
+    """
+    Ограниченный LRU-кэш с временем жизни записей.
+
+    Вытесняет самые давно использованные записи, когда превышено число записей
+    или примерный объем в байтах (по функции sizeof). Просроченная запись
+    считается промахом и удаляется при обращении.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1024,
+        ttl: float = 60.0,
+        max_bytes: int | None = None,
+        sizeof = sys.getsizeof
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+
+        # key -> (expires_at, size, value)
+        self._data: OrderedDict = OrderedDict()
+        self.size_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _drop(
+        self,
+        key
+    ):
+        _, size, _ = self._data.pop(key)
+        self.size_bytes -= size
+
+    def get(
+        self,
+        key
+    ):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, _, value = item
+        if expires_at <= time.monotonic():
+            self._drop(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(
+        self,
+        key,
+        value,
+        ttl: float | None = None
+    ):
+        if key in self._data:
+            self._drop(key)
+
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self.size_bytes += size
+
+        while len(self._data) > self.max_entries or (self.max_bytes is not None and self.size_bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def invalidate(
+        self,
+        key
+    ):
+        if key in self._data:
+            self._drop(key)
+
+    def clear(self):
+        self._data.clear()
+        self.size_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "size_bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -0,0 +1,123 @@
+from collections import deque
+from enum import Enum
+from fastapi import HTTPException, status
+import time
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(HTTPException):
+    def __init__(self, name: str):
+        super().__init__(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail = f'Service {name} is unavailable'
+        )
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Предохранитель на один нижестоящий сервис.
+
+    Считает исходы последних window_size вызовов. Если доля ошибок или медленных
+    вызовов превышает порог - размыкается на open_duration секунд и отбивает
+    вызовы сразу. Потом пропускает half_open_max_calls пробных вызовов:
+    все успешны - замыкается, хоть один упал - снова размыкается.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_rate_threshold: float = 1.0,
+        slow_call_duration: float = 5.0,
+        window_size: int = 20,
+        min_calls: int = 10,
+        open_duration: float = 30.0,
+        half_open_max_calls: int = 3
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.min_calls = min_calls
+        self.open_duration = open_duration
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = CircuitState.CLOSED
+        self._calls = deque(maxlen = window_size)
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+
+    def _transition(
+        self,
+        state: CircuitState
+    ):
+        self.state = state
+        self._calls.clear()
+        self._half_open_calls = 0
+        self._half_open_successes = 0
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+
+    def _cooldown_passed(self) -> bool:
+        return time.monotonic() - self._opened_at >= self.open_duration
+
+    def is_available(self) -> bool:
+        # Без побочных эффектов: пробные вызовы полуоткрытого состояния не расходуются
+        if self.state == CircuitState.OPEN:
+            return self._cooldown_passed()
+        if self.state == CircuitState.HALF_OPEN:
+            return self._half_open_calls < self.half_open_max_calls
+        return True
+
+    def before_call(self):
+        if self.state == CircuitState.OPEN:
+            if not self._cooldown_passed():
+                raise CircuitOpenError(self.name)
+            self._transition(CircuitState.HALF_OPEN)
+
+        if self.state == CircuitState.HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                raise CircuitOpenError(self.name)
+            self._half_open_calls += 1
+
+    def release(self):
+        # Вызов отменили, исхода нет - возвращаем пробный слот
+        if self.state == CircuitState.HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record(
+        self,
+        success: bool,
+        duration: float
+    ):
+        slow = duration >= self.slow_call_duration
+
+        if self.state == CircuitState.HALF_OPEN:
+            if not success or slow:
+                self._transition(CircuitState.OPEN)
+                return
+            self._half_open_successes += 1
+            if self._half_open_successes >= self.half_open_max_calls:
+                self._transition(CircuitState.CLOSED)
+            return
+
+        if self.state == CircuitState.OPEN:
+            # Ответ на вызов, начатый до размыкания
+            return
+
+        self._calls.append((success, slow))
+        total = len(self._calls)
+        if total < self.min_calls:
+            return
+
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow_calls = sum(1 for _, is_slow in self._calls if is_slow)
+        if failures / total >= self.failure_rate_threshold or slow_calls / total >= self.slow_call_rate_threshold:
+            self._transition(CircuitState.OPEN)
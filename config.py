@@ -56,6 +56,8 @@ class WarehouseURL(BaseModel):
     reserve_create_endpoint: str = os.getenv("WAREHOUSE_RESERVE_CREATE_ENDPOINT", "reservations")
     reserve_get_endpoint: str = os.getenv("WAREHOUSE_RESERVE_GET_ENDPOINT", "reservations/order")
     reserve_cancel_endpoint: str = os.getenv("WAREHOUSE_RESERVE_CANCEL_ENDPOINT", "reservations/order/cancel")
+    # Пакетное получение остатков, если склад его поддерживает (иначе - по одному товару)
+    stock_batch_endpoint: str | None = os.getenv("WAREHOUSE_STOCK_BATCH_ENDPOINT")
     port: str = os.getenv("WAREHOUSE_PORT")
 
 class DeliveryURL(BaseModel):
@@ -70,6 +72,9 @@ class DeliveryURL(BaseModel):
 class AuthJWT(BaseModel):
     public_key_path: Path =  BASE_DIR /os.getenv("JWT_PUBLIC_PATH", "./etc/keys/jwt-public.pem")
     algorithm: str = os.getenv("JWT_ALGORITH", "RS256")
+    # Кэш проверенных токенов: запись живет до exp, но не дольше cache_max_ttl
+    cache_max_entries: int = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+    cache_max_ttl: float = float(os.getenv("JWT_CACHE_MAX_TTL", "300"))
 
 
 class DbSettings(BaseModel):
@@ -80,6 +85,167 @@ class DbSettings(BaseModel):
     port: str = os.getenv("DB_PORT", "5432")
     database: str = os.getenv("DB_NAME", "saga")
 
+class HttpClientSettings(BaseModel):
+    # Один долгоживущий клиент на каждый нижестоящий сервис, параметры пула общие
+    max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    timeout: float = float(os.getenv("HTTP_TIMEOUT", "10"))
+    http2: bool = os.getenv("HTTP_HTTP2", "false").lower() in ("1", "true", "yes")
+    # Одинаковые одновременные GET к одному URL уходят вниз одним запросом
+    single_flight: bool = os.getenv("HTTP_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+
+
+class CircuitBreakerSettings(BaseModel):
+    enabled: bool = os.getenv("CB_ENABLED", "true").lower() in ("1", "true", "yes")
+    failure_rate_threshold: float = float(os.getenv("CB_FAILURE_RATE_THRESHOLD", "0.5"))
+    slow_call_rate_threshold: float = float(os.getenv("CB_SLOW_CALL_RATE_THRESHOLD", "1.0"))
+    slow_call_duration: float = float(os.getenv("CB_SLOW_CALL_DURATION", "5"))
+    window_size: int = int(os.getenv("CB_WINDOW_SIZE", "20"))
+    min_calls: int = int(os.getenv("CB_MIN_CALLS", "10"))
+    open_duration: float = float(os.getenv("CB_OPEN_DURATION", "30"))
+    half_open_max_calls: int = int(os.getenv("CB_HALF_OPEN_MAX_CALLS", "3"))
+
+
+class BulkheadSettings(BaseModel):
+    enabled: bool = os.getenv("BULKHEAD_ENABLED", "true").lower() in ("1", "true", "yes")
+    max_concurrent: int = int(os.getenv("BULKHEAD_MAX_CONCURRENT", "50"))
+    max_queue: int = int(os.getenv("BULKHEAD_MAX_QUEUE", "100"))
+    queue_timeout: float = float(os.getenv("BULKHEAD_QUEUE_TIMEOUT", "1"))
+
+    def for_service(
+        self,
+        name: str
+    ) -> dict:
+        # Лимиты конкретного сервиса: BULKHEAD_<NAME>_MAX_CONCURRENT и т.д., иначе общие
+        prefix = f"BULKHEAD_{name.upper()}_"
+        return {
+            "max_concurrent": int(os.getenv(prefix + "MAX_CONCURRENT", self.max_concurrent)),
+            "max_queue": int(os.getenv(prefix + "MAX_QUEUE", self.max_queue)),
+            "queue_timeout": float(os.getenv(prefix + "QUEUE_TIMEOUT", self.queue_timeout)),
+        }
+
+
+class HedgeSettings(BaseModel):
+    # Хеджирование идемпотентных GET, только для операций, которые его явно включили
+    enabled: bool = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+    # Второй запрос уходит, если первый не ответил за этот перцентиль недавних задержек
+    percentile: float = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+    min_delay: float = float(os.getenv("HEDGE_MIN_DELAY", "0.01"))
+    max_delay: float = float(os.getenv("HEDGE_MAX_DELAY", "1"))
+    window_size: int = int(os.getenv("HEDGE_WINDOW_SIZE", "200"))
+    min_samples: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+    # Доля дополнительных запросов от общего числа и запас на всплеск
+    budget_ratio: float = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+    budget_burst: float = float(os.getenv("HEDGE_BUDGET_BURST", "10"))
+
+
+class DeadlineSettings(BaseModel):
+    # Заголовок с оставшимся бюджетом запроса в секундах: принимаем от клиента и отдаем вниз
+    header: str = os.getenv("DEADLINE_HEADER", "X-Request-Timeout")
+    default_timeout: float = float(os.getenv("DEADLINE_DEFAULT_TIMEOUT", "30"))
+    # Бюджет саги, которую ведет воркер или разгребатель, а не запрос
+    saga_timeout: float = float(os.getenv("DEADLINE_SAGA_TIMEOUT", "60"))
+    # "МЕТОД /префикс=секунды" через запятую, 0 - без срока (стримы)
+    route_timeouts: str = os.getenv(
+        "DEADLINE_ROUTE_TIMEOUTS",
+        "POST /orders=60,GET /sagas/export=0"
+    )
+
+    def timeout_for(
+        self,
+        method: str,
+        path: str
+    ) -> float | None:
+        # Побеждает самый длинный подходящий префикс
+        best, best_len = self.default_timeout, -1
+        for rule in self.route_timeouts.split(","):
+            if "=" not in rule:
+                continue
+            route, timeout = rule.rsplit("=", 1)
+            route_method, _, prefix = route.strip().partition(" ")
+            if route_method == method and path.startswith(prefix) and len(prefix) > best_len:
+                best, best_len = float(timeout), len(prefix)
+        return best if best > 0 else None
+
+
+class CacheSettings(BaseModel):
+    profile_ttl: float = float(os.getenv("CACHE_PROFILE_TTL", "60"))
+    profile_max_entries: int = int(os.getenv("CACHE_PROFILE_MAX_ENTRIES", "10000"))
+    # Баланс меняется и мимо шлюза (сторно при откате саг), поэтому живет недолго
+    wallet_ttl: float = float(os.getenv("CACHE_WALLET_TTL", "5"))
+    wallet_max_entries: int = int(os.getenv("CACHE_WALLET_MAX_ENTRIES", "10000"))
+    max_bytes: int = int(os.getenv("CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+class RecoverySettings(BaseModel):
+    # Фоновый разгребатель зависших UNFINISHED саг
+    enabled: bool = os.getenv("RECOVERY_ENABLED", "true").lower() in ("1", "true", "yes")
+    interval: float = float(os.getenv("RECOVERY_INTERVAL", "30"))
+    # Сага без изменений дольше этого времени считается брошенной
+    stale_after: float = float(os.getenv("RECOVERY_STALE_AFTER", "300"))
+    batch_size: int = int(os.getenv("RECOVERY_BATCH_SIZE", "50"))
+    concurrency: int = int(os.getenv("RECOVERY_CONCURRENCY", "5"))
+
+
+class SagaWorkerSettings(BaseModel):
+    # Пул воркеров асинхронного режима POST /orders/async
+    workers: int = int(os.getenv("SAGA_WORKERS", "10"))
+    queue_size: int = int(os.getenv("SAGA_QUEUE_SIZE", "1000"))
+
+
+class TracingSettings(BaseModel):
+    # none | console | file | otlp
+    exporter: str = os.getenv("TRACING_EXPORTER", "none")
+    service_name: str = os.getenv("TRACING_SERVICE_NAME", "api-gateway")
+    sample_ratio: float = float(os.getenv("TRACING_SAMPLE_RATIO", "1"))
+    file_path: str = os.getenv("TRACING_FILE", "traces.jsonl")
+    otlp_endpoint: str = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+
+
+class MetricsSettings(BaseModel):
+    # Счетчики попаданий/промахов кэшей профилей, кошельков и JWT в /metrics
+    export_caches: bool = os.getenv("METRICS_EXPORT_CACHES", "true").lower() in ("1", "true", "yes")
+
+
+class LogSettings(BaseModel):
+    level: str = os.getenv("LOG_LEVEL", "INFO")
+    # Доля записей ниже WARNING по логгерам: "service=0.01,saga_engine=0.1"
+    sampling: str = os.getenv("LOG_SAMPLING", "")
+    # Сколько записей ждут фонового писателя, лишние выбрасываются
+    queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Уровень для библиотек, которые пишут строку на каждый вызов вниз (httpx, httpcore)
+    library_level: str = os.getenv("LOG_LIBRARY_LEVEL", "WARNING")
+
+
+class ResponseSettings(BaseModel):
+    # Готовые модели сериализуются сразу в байты, без повторной проверки по response_model
+    fast: bool = os.getenv("RESPONSES_FAST", "true").lower() in ("1", "true", "yes")
+
+
+class StockLookupSettings(BaseModel):
+    # POST /stocks/lookup: сколько товаров за раз и сколько запросов к складу одновременно
+    max_ids: int = int(os.getenv("STOCK_LOOKUP_MAX_IDS", "200"))
+    concurrency: int = int(os.getenv("STOCK_LOOKUP_CONCURRENCY", "10"))
+
+
+class SagaRetrySettings(BaseModel):
+    # Повторы прямых шагов саги заказа на временных ошибках (502/503/504, обрывы связи).
+    # Безопасны, потому что каждый вызов несет ключ идемпотентности
+    attempts: int = int(os.getenv("SAGA_RETRY_ATTEMPTS", "3"))
+    base_delay: float = float(os.getenv("SAGA_RETRY_BASE_DELAY", "0.2"))
+    max_delay: float = float(os.getenv("SAGA_RETRY_MAX_DELAY", "2"))
+    jitter: float = float(os.getenv("SAGA_RETRY_JITTER", "0.5"))
+    idempotency_header: str = os.getenv("IDEMPOTENCY_HEADER", "Idempotency-Key")
+
+
+class SagaListSettings(BaseModel):
+    page_size: int = int(os.getenv("SAGAS_PAGE_SIZE", "10"))
+    max_page_size: int = int(os.getenv("SAGAS_MAX_PAGE_SIZE", "100"))
+    # Сколько строк серверный курсор выгрузки тянет из БД за раз
+    export_batch_size: int = int(os.getenv("SAGAS_EXPORT_BATCH_SIZE", "1000"))
+
+
 class Settings(BaseSettings):
     auth_jwt: AuthJWT = AuthJWT()
     auth_url: AuthURL = AuthURL()
@@ -90,5 +256,20 @@ class Settings(BaseSettings):
     deliv_url: DeliveryURL = DeliveryURL()
     wareh_url: WarehouseURL = WarehouseURL()
     db: DbSettings = DbSettings()
+    http: HttpClientSettings = HttpClientSettings()
+    breaker: CircuitBreakerSettings = CircuitBreakerSettings()
+    bulkhead: BulkheadSettings = BulkheadSettings()
+    deadline: DeadlineSettings = DeadlineSettings()
+    hedge: HedgeSettings = HedgeSettings()
+    cache: CacheSettings = CacheSettings()
+    recovery: RecoverySettings = RecoverySettings()
+    saga_workers: SagaWorkerSettings = SagaWorkerSettings()
+    saga_list: SagaListSettings = SagaListSettings()
+    saga_retry: SagaRetrySettings = SagaRetrySettings()
+    stock_lookup: StockLookupSettings = StockLookupSettings()
+    responses: ResponseSettings = ResponseSettings()
+    logs: LogSettings = LogSettings()
+    metrics: MetricsSettings = MetricsSettings()
+    tracing: TracingSettings = TracingSettings()
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import HTTPException, status
+import time
+
+
+# Абсолютный срок (time.monotonic) текущего запроса или саги, None - без срока
+_deadline: ContextVar = ContextVar('deadline', default = None)
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code = status.HTTP_504_GATEWAY_TIMEOUT,
+            detail = 'Request deadline exceeded'
+        )
+
+
+def remaining() -> float | None:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check():
+    if expired():
+        raise DeadlineExceeded()
+
+
+def bound(
+    timeout: float | None
+) -> float | None:
+    # Таймаут операции, урезанный оставшимся бюджетом
+    left = remaining()
+    if left is None:
+        return timeout
+    if timeout is None:
+        return max(left, 0.0)
+    return max(min(timeout, left), 0.0)
+
+
+@contextmanager
+def deadline_scope(
+    timeout: float | None
+):
+    # Вложенный срок не может быть позже внешнего
+    deadline = _deadline.get()
+    if timeout is not None:
+        new_deadline = time.monotonic() + timeout
+        if deadline is None or new_deadline < deadline:
+            deadline = new_deadline
+
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def no_deadline():
+    # Компенсации обязаны доделаться, даже если бюджет запроса уже потрачен
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def parse_timeout(
+    value: str | None
+) -> float | None:
+    if value is None:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    return timeout if timeout > 0 else None
@@ -0,0 +1,118 @@
+from config import settings, Settings
+from dataclasses import dataclass
+
+
+# Сервис -> поле Settings с его адресами
+SERVICE_URLS = {
+    'auth': 'auth_url',
+    'profile': 'prof_url',
+    'billing': 'bill_url',
+    'order': 'order_url',
+    'notification': 'notif_url',
+    'warehouse': 'wareh_url',
+    'delivery': 'deliv_url',
+}
+
+ENDPOINT_SUFFIX = '_endpoint'
+
+
+def _present(
+    value
+) -> str | None:
+    # Переменные окружения из манифестов приходят и как "None", и пустыми
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value in ('', 'None', 'none', 'null'):
+        return None
+    return value
+
+
+@dataclass(frozen = True)
+class Endpoint:
+    operation: str
+    service: str
+    # Готовый URL без параметра и шаблон с одним параметром в конце пути
+    base: str
+    template: str
+
+    def url(
+        self,
+        param: str | None = None
+    ) -> str:
+        if param is None:
+            return self.base
+        return self.template.format(param)
+
+
+class EndpointNotConfigured(LookupError):
+    pass
+
+
+class EndpointRegistry:
+    """
+    Адреса всех операций нижестоящих сервисов, собранные один раз из настроек.
+
+    Операция называется по полю *_endpoint своего сервиса: warehouse.reserve_cancel,
+    order.get_by_id и т.д. Базовый адрес - http://host[:port][/path], где port и path
+    необязательны. На вызов остается поиск в словаре и не больше одного format.
+    """
+
+    def __init__(
+        self,
+        endpoints: dict
+    ):
+        self._endpoints = endpoints
+
+    @classmethod
+    def compile(
+        cls,
+        config: Settings
+    ) -> 'EndpointRegistry':
+        endpoints = {}
+        for service, field in SERVICE_URLS.items():
+            url_settings = getattr(config, field)
+
+            base = 'http://' + url_settings.host
+            port = _present(url_settings.port)
+            if port is not None:
+                base += ':' + port
+            path = _present(url_settings.path)
+            if path is not None and path.strip('/'):
+                base += '/' + path.strip('/')
+
+            for name, value in url_settings:
+                if not name.endswith(ENDPOINT_SUFFIX):
+                    continue
+                endpoint = _present(value)
+                if endpoint is None:
+                    continue
+                operation = name[:-len(ENDPOINT_SUFFIX)]
+                url = base + '/' + endpoint.strip('/')
+                # Фигурные скобки из настроек не должны стать плейсхолдерами
+                template = url.replace('{', '{{').replace('}', '}}') + '/{}'
+                endpoints[(service, operation)] = Endpoint(f'{service}.{operation}', service, url, template)
+        return cls(endpoints)
+
+    def has(
+        self,
+        service: str,
+        operation: str
+    ) -> bool:
+        return (service, operation) in self._endpoints
+
+    def get(
+        self,
+        service: str,
+        operation: str
+    ) -> Endpoint:
+        endpoint = self._endpoints.get((service, operation))
+        if endpoint is None:
+            raise EndpointNotConfigured(f'{service}.{operation}')
+        return endpoint
+
+    def __iter__(self):
+        return iter(self._endpoints.values())
+
+
+registry = EndpointRegistry.compile(settings)
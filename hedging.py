@@ -0,0 +1,121 @@
+from collections import deque
+from typing import Any, Awaitable, Callable
+from metrics import HEDGED_REQUESTS
+import asyncio
+import math
+import time
+
+
+class HedgeBudget:
+    """
+    Бюджет на хеджирование: каждый запрос добавляет ratio токена (не больше
+    max_tokens), каждый дополнительный запрос тратит целый токен. Так хеджей
+    в среднем не больше доли ratio от всех запросов, даже если сервис тормозит целиком.
+    """
+
+    def __init__(
+        self,
+        ratio: float = 0.1,
+        max_tokens: float = 10.0
+    ):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class Hedger:
+    """
+    Хеджирование идемпотентных чтений одной операции.
+
+    Если запрос не ответил за задержку, равную percentile от недавних задержек
+    этой операции (в пределах min_delay..max_delay), уходит второй такой же.
+    Побеждает первый успешный ответ, проигравший отменяется. Пока замеров
+    меньше min_samples, ждем max_delay.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 0.95,
+        min_delay: float = 0.01,
+        max_delay: float = 1.0,
+        window_size: int = 200,
+        min_samples: int = 20,
+        budget: HedgeBudget | None = None
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = budget or HedgeBudget()
+        self._latencies = deque(maxlen = window_size)
+
+    def delay(self) -> float:
+        if len(self._latencies) < self.min_samples:
+            return self.max_delay
+        ordered = sorted(self._latencies)
+        index = min(math.ceil(self.percentile * len(ordered)) - 1, len(ordered) - 1)
+        return min(max(ordered[max(index, 0)], self.min_delay), self.max_delay)
+
+    def record(
+        self,
+        duration: float
+    ):
+        self._latencies.append(duration)
+
+    async def _timed(
+        self,
+        func: Callable[[], Awaitable[Any]]
+    ):
+        start = time.monotonic()
+        result = await func()
+        self.record(time.monotonic() - start)
+        return result
+
+    async def run(
+        self,
+        func: Callable[[], Awaitable[Any]]
+    ):
+        self.budget.deposit()
+
+        primary = asyncio.ensure_future(self._timed(func))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout = self.delay())
+            if done:
+                return primary.result()
+
+            if not self.budget.try_spend():
+                HEDGED_REQUESTS.labels(self.name, 'budget_exhausted').inc()
+                return await primary
+
+            HEDGED_REQUESTS.labels(self.name, 'sent').inc()
+            hedge = asyncio.ensure_future(self._timed(func))
+            pending = {primary, hedge}
+            error = None
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                HEDGED_REQUESTS.labels(self.name, 'won').inc()
+                            return task.result()
+                        # Упавшая попытка не решает исход, пока жива вторая
+                        error = error or task.exception()
+                raise error
+            finally:
+                for task in pending:
+                    task.cancel()
+        finally:
+            if not primary.done():
+                primary.cancel()
@@ -0,0 +1,61 @@
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from cache import TTLCache
+import hashlib
+import jwt
+import time
+
+
+class JWTVerifier:
+    """
+    Проверка JWT с разобранным один раз ключом.
+
+    Успешно проверенные payload кэшируются по sha256 токена до его exp,
+    так что повторный токен проверяется поиском в словаре.
+    """
+
+    def __init__(
+        self,
+        public_key_pem: str,
+        algorithm: str,
+        cache_max_entries: int = 10000,
+        cache_max_ttl: float = 300.0
+    ):
+        self._key = load_pem_public_key(public_key_pem.encode())
+        self._algorithms = [algorithm]
+        self._cache_max_ttl = cache_max_ttl
+        self._cache = TTLCache(
+            'jwt',
+            max_entries = cache_max_entries,
+            ttl = cache_max_ttl
+        )
+
+    @property
+    def cache(self) -> TTLCache:
+        return self._cache
+
+    def verify(
+        self,
+        token: str | bytes
+    ) -> dict:
+        if isinstance(token, str):
+            token = token.encode()
+        digest = hashlib.sha256(token).digest()
+
+        payload = self._cache.get(digest)
+        if payload is not None:
+            return payload
+
+        # Невалидный токен выкинет InvalidTokenError и в кэш не попадет
+        payload = jwt.decode(
+            token,
+            self._key,
+            algorithms = self._algorithms
+        )
+
+        ttl = self._cache_max_ttl
+        exp = payload.get('exp')
+        if exp is not None:
+            ttl = min(ttl, float(exp) - time.time())
+        self._cache.set(digest, payload, ttl = ttl)
+
+        return payload
@@ -0,0 +1,163 @@
+from logging.handlers import QueueHandler, QueueListener
+from config import settings
+from datetime import datetime, timezone
+import logging
+import queue
+import random
+import json
+import sys
+import copy
+
+
+# Атрибуты, которые есть у любой LogRecord - все остальное пришло через extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'taskName'}
+
+# httpx пишет INFO "HTTP Request: ..." на каждый запрос - это как раз горячий путь
+_LIBRARY_LOGGERS = ('httpx', 'httpcore')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись в одну строку JSON: время, уровень, логгер, сообщение и все поля из extra
+    (saga_id, step, duration и т.п.) как есть.
+    """
+
+    def format(
+        self,
+        record: logging.LogRecord
+    ) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii = False, default = str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает долю rate записей ниже WARNING, rate берется по самому длинному
+    совпадающему префиксу имени логгера. Предупреждения и ошибки не прореживаются.
+    """
+
+    def __init__(
+        self,
+        rates: dict
+    ):
+        super().__init__()
+        self.rates = rates
+        self._resolved: dict = {}
+
+    def _rate(
+        self,
+        name: str
+    ) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, best_len = 1.0, -1
+            for prefix, prefix_rate in self.rates.items():
+                if (name == prefix or name.startswith(prefix + '.')) and len(prefix) > best_len:
+                    rate, best_len = prefix_rate, len(prefix)
+            self._resolved[name] = rate
+        return rate
+
+    def filter(
+        self,
+        record: logging.LogRecord
+    ) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь и сразу возвращается - пишет в stdout фоновый поток
+    QueueListener. Переполненная очередь запись выбрасывает, а не блокирует event loop.
+    """
+
+    dropped = 0
+
+    def prepare(
+        self,
+        record: logging.LogRecord
+    ) -> logging.LogRecord:
+        # Сообщение и трейсбек собираем здесь, пока аргументы живы, а JSON - уже в потоке
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(
+        self,
+        record: logging.LogRecord
+    ):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+def parse_rates(
+    value: str
+) -> dict:
+    # "логгер=доля" через запятую: "service=0.01,saga_engine=1"
+    rates = {}
+    for rule in value.split(','):
+        if '=' not in rule:
+            continue
+        name, rate = rule.rsplit('=', 1)
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+_listener: QueueListener | None = None
+
+
+def setup():
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(settings.logs.queue_size)
+
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_rates(settings.logs.sampling)))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.setLevel(settings.logs.level.upper())
+    root.addHandler(handler)
+
+    for name in _LIBRARY_LOGGERS:
+        logging.getLogger(name).setLevel(settings.logs.library_level.upper())
+
+    _listener = QueueListener(log_queue, output, respect_handler_level = True)
+    _listener.start()
+
+
+def shutdown():
+    global _listener
+    if _listener is None:
+        return
+
+    # Дописываем все, что успело попасть в очередь
+    _listener.stop()
+    _listener = None
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
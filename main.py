@@ -1,4 +1,4 @@
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, status
 from prometheus_fastapi_instrumentator import Instrumentator
 from models import (
     TokenInfo,  
@@ -20,17 +20,106 @@ from models import (
     CourierReturn,
     SagaReturn, 
     DeliveryReturn,
-    ReservationReturn
+    ReservationReturn,
+    SagaAcceptedReturn,
+    OrderDetailsReturn,
+    StockLookup,
+    StockLookupReturn
 )
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.responses import StreamingResponse
+from responses import model_response
+from prometheus_client import REGISTRY
+from metrics import PoolCollector
 import utils
 from uuid import UUID
 from typing import List
-from db import _get_db
+from db import _get_db, AsyncSessionLocal, engine
+from service import Service
+from saga_recovery import SagaRecoveryWorker
+from config import settings
+from saga_db_schema import SagaStatus
+from datetime import datetime
+import deadline
+import logs
+import tracing
+from contextlib import asynccontextmanager
 
 # import uvicorn
 
-app = FastAPI(title="Client API Gateway", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Пулы соединений к нижестоящим сервисам живут столько же, сколько приложение
+    logs.setup()
+    tracing.setup()
+    Service.open_clients()
+
+    recovery_worker = None
+    if settings.recovery.enabled:
+        recovery_worker = SagaRecoveryWorker(
+            AsyncSessionLocal,
+            interval = settings.recovery.interval,
+            stale_after = settings.recovery.stale_after,
+            batch_size = settings.recovery.batch_size,
+            concurrency = settings.recovery.concurrency
+        )
+        recovery_worker.start()
+
+    utils.saga_pool.start()
+
+    yield
+
+    await utils.saga_pool.stop()
+    if recovery_worker is not None:
+        await recovery_worker.stop()
+    await Service.close_clients()
+    tracing.shutdown()
+    logs.shutdown()
+
+
+app = FastAPI(title="Client API Gateway", version="1.0.0", lifespan=lifespan)
+
+# HTTP-метрики самого шлюза плюс все метрики из реестра prometheus_client по умолчанию
+# (нижестоящие вызовы, шаги саг, переборки) на /metrics
+Instrumentator().instrument(app).expose(app, include_in_schema = False)
+
+REGISTRY.register(PoolCollector(
+    clients = lambda: Service._clients,
+    db_pool = lambda: engine.pool,
+    caches = (lambda: [utils.profile_cache, utils.wallet_cache, utils.jwt_verifier.cache]) if settings.metrics.export_caches else None
+))
+
+
+@app.middleware("http")
+async def deadline_middleware(request: Request, call_next):
+    # Срок запроса: из заголовка клиента (не дольше дефолта маршрута) или дефолт маршрута
+    timeout = settings.deadline.timeout_for(request.method, request.url.path)
+    client_timeout = deadline.parse_timeout(request.headers.get(settings.deadline.header))
+    if client_timeout is not None:
+        timeout = client_timeout if timeout is None else min(timeout, client_timeout)
+
+    with deadline.deadline_scope(timeout):
+        return await call_next(request)
+
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    # Объявлен последним, поэтому внешний: спан покрывает и дедлайн, и обработчик
+    with tracing.server_span(request.method, request.headers, {
+        'http.method': request.method,
+        'http.target': request.url.path,
+    }) as current:
+        response = await call_next(request)
+        # Имя спана - по шаблону маршрута, а не по пути с идентификаторами
+        route = request.scope.get('route')
+        if route is not None:
+            current.update_name(f'{request.method} {route.path}')
+            current.set_attribute('http.route', route.path)
+        current.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            tracing.set_error(current, f'HTTP {response.status_code}')
+        return response
 
 @app.get("/health", summary="HealthCheck EndPoint", tags=["Health Check"])
 def healthcheck():
@@ -54,7 +143,7 @@ async def get_profile (
     token_payload: dict = Depends(utils.get_current_token_payload) 
 ):
     result = await utils.get_profile(req_uname, token_payload) 
-    return result
+    return model_response(result)
 
 
 @app.put("/profile/{req_uname}", summary = 'Update User profile', tags = ['Profile'],  response_model=ProfileReturn, status_code=status.HTTP_200_OK)
@@ -87,7 +176,7 @@ async def get_wallet(
 ):
     wallet = await utils.get_wallet(req_uname, token_payload)
 
-    return wallet
+    return model_response(wallet)
 
 
 @app.post("/transaction", summary = 'Create billing transaction', tags = ['Billing', 'Transaction'], response_model = TransactionReturn)
@@ -111,6 +200,21 @@ async def create_order(
     return order
 
 
+@app.post("/orders/async", summary = 'Submit order for asynchronous processing', tags = ['Orders', 'Saga'], response_model = SagaAcceptedReturn, status_code = status.HTTP_202_ACCEPTED)
+async def submit_order(
+    order_data: OrderCreate,
+    response: Response,
+    token_payload: dict = Depends(utils.get_current_token_payload),
+    db = Depends(_get_db)
+):
+    accepted = await utils.submit_new_order(order_data, token_payload, db)
+
+    # Статус саги клиент опрашивает через GET /sagas/{id}
+    response.headers['Location'] = f'/sagas/{accepted.saga_id}'
+
+    return accepted
+
+
 @app.get("/orders/id/{order_id}", summary = 'Get order by ID', tags = ['Orders'], response_model = OrderReturn)
 async def get_order_by_id(
     order_id: UUID,
@@ -118,7 +222,7 @@ async def get_order_by_id(
 ):
     order = await utils.get_order_by_id(order_id, token_payload)
 
-    return order
+    return model_response(order)
 
 
 @app.get("/orders/user/{req_uname}", summary = 'Get orders for user', tags = ['Orders'], response_model = List[OrderReturn])
@@ -128,7 +232,33 @@ async def get_orders_for_user(
 ):
     orders = await utils.get_orders_by_uname(req_uname, token_payload)
 
-    return orders
+    return model_response(orders)
+
+
+@app.get("/orders/user/{req_uname}/stream", summary = 'Stream orders for user', tags = ['Orders'], response_model = List[OrderReturn])
+async def stream_orders_for_user(
+    req_uname: str,
+    limit: int | None = Query(None, ge = 1),
+    offset: int | None = Query(None, ge = 0),
+    accept_encoding: str | None = Header(None),
+    token_payload: dict = Depends(utils.get_current_token_payload)
+):
+    # Тот же ответ, что у /orders/user/{req_uname}, но JSON-массив сервиса заказов
+    # пробрасывается по кускам: память не растет с числом заказов
+    body, media_type, headers = await utils.stream_orders_by_uname(req_uname, token_payload, limit, offset, accept_encoding)
+
+    return StreamingResponse(body, media_type = media_type, headers = headers)
+
+
+@app.get("/orders/{order_id}/details", summary = 'Get order with notifications, delivery, reservation and saga', tags = ['Orders'], response_model = OrderDetailsReturn)
+async def get_order_details(
+    order_id: UUID,
+    token_payload: dict = Depends(utils.get_current_token_payload),
+    db = Depends(_get_db)
+):
+    details = await utils.get_order_details(order_id, token_payload, db)
+
+    return model_response(details)
 
 
 @app.get('/notifications/{order_id}', summary = 'Get notifications for order', tags = ['Notifications', 'Orders'], response_model = List[NotificationReturn])
@@ -138,7 +268,7 @@ async def get_notifications_for_order(
 ):
     notifications = await utils.get_notifications_for_order(order_id, token_payload)
     
-    return notifications
+    return model_response(notifications)
 
 
 @app.post('/goods', summary='Create new good', tags=['Warehouse', 'Goods'], response_model=GoodReturn, status_code = status.HTTP_201_CREATED)
@@ -161,6 +291,16 @@ async def stock_add(
     return stock
 
 
+@app.post('/stocks/lookup', summary='Get stock for several goods', tags=['Warehouse', 'Stocks'], response_model=StockLookupReturn)
+async def stocks_lookup(
+    lookup: StockLookup,
+    token_payload: dict = Depends(utils.get_current_token_payload)
+):
+    stocks = await utils.stocks_lookup(lookup.good_ids)
+
+    return model_response(stocks)
+
+
 @app.get('/stocks/{good_id}', summary='Get stock for good', tags=['Warehouse', 'Stocks'], response_model=StockReturn)
 async def stock_get_by_good_id(
     good_id: UUID,
@@ -168,7 +308,7 @@ async def stock_get_by_good_id(
 ):
     stock = await utils.stock_get_by_good_id(good_id)
 
-    return stock
+    return model_response(stock)
 
 
 @app.get('/reservations/{order_id}', summary='Get reservation for order', tags=['Warehouse', 'Reservations'], response_model=ReservationReturn)
@@ -178,7 +318,7 @@ async def reservation_get_by_order_id(
 ):
     reservation = await utils.reservation_get_by_order_id(order_id)
 
-    return reservation
+    return model_response(reservation)
 
 
 @app.post('/couriers', summary = 'Create new courier', tags=['Delivery', 'Couriers'], response_model = CourierReturn, status_code = status.HTTP_201_CREATED)
@@ -198,18 +338,55 @@ async def get_delivery_by_order_id(
 ):
     delivery = await utils.delivery_get_by_order_id(order_id)
 
-    return delivery
+    return model_response(delivery)
 
 
 @app.get('/sagas', summary = 'Get all order sagas', tags=['Saga'], response_model = List[SagaReturn])
 async def get_sagas_list(
+    response: Response,
+    limit: int = Query(settings.saga_list.page_size, ge = 1, le = settings.saga_list.max_page_size),
+    cursor: str | None = Query(None, description = 'Value of X-Next-Cursor from the previous page'),
+    saga_status: SagaStatus | None = Query(None, alias = 'status'),
+    updated_from: datetime | None = None,
+    updated_to: datetime | None = None,
+    order_id: UUID | None = None,
     db = Depends(_get_db)
 ):
-    sagas = await utils.get_all_order_sagas(db)
+    sagas, next_cursor = await utils.get_all_order_sagas(
+        db,
+        limit = limit,
+        cursor = cursor,
+        saga_status = saga_status,
+        updated_from = updated_from,
+        updated_to = updated_to,
+        order_id = order_id
+    )
+
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
 
     return sagas
 
 
+@app.get('/sagas/export', summary = 'Export order sagas as NDJSON', tags=['Saga'])
+async def export_sagas(
+    cursor: str | None = Query(None, description = 'Cursor of the last received row to resume from'),
+    saga_status: SagaStatus | None = Query(None, alias = 'status'),
+    updated_from: datetime | None = None,
+    updated_to: datetime | None = None,
+    order_id: UUID | None = None
+):
+    rows = utils.export_order_sagas(
+        cursor = cursor,
+        saga_status = saga_status,
+        updated_from = updated_from,
+        updated_to = updated_to,
+        order_id = order_id
+    )
+
+    return StreamingResponse(rows, media_type = 'application/x-ndjson')
+
+
 @app.get('/sagas/{saga_id}', summary = 'Get order saga by ID', tags=['Saga'], response_model = SagaReturn)
 async def get_sagas_list(
     saga_id: UUID,
@@ -0,0 +1,145 @@
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from typing import Callable
+
+
+BULKHEAD_IN_FLIGHT = Gauge(
+    'gateway_bulkhead_in_flight',
+    'Downstream calls currently executing inside the bulkhead',
+    ['service']
+)
+
+BULKHEAD_QUEUE_DEPTH = Gauge(
+    'gateway_bulkhead_queue_depth',
+    'Downstream calls waiting for a bulkhead slot',
+    ['service']
+)
+
+BULKHEAD_WAIT_SECONDS = Histogram(
+    'gateway_bulkhead_wait_seconds',
+    'Time spent waiting for a bulkhead slot',
+    ['service'],
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+BULKHEAD_REJECTED = Counter(
+    'gateway_bulkhead_rejected_total',
+    'Downstream calls rejected by the bulkhead',
+    ['service', 'reason']
+)
+
+HEDGED_REQUESTS = Counter(
+    'gateway_hedged_requests_total',
+    'Hedged downstream reads: hedges sent, won by the hedge, or skipped for lack of budget',
+    ['operation', 'outcome']
+)
+
+DOWNSTREAM_LATENCY = Histogram(
+    'gateway_downstream_request_seconds',
+    'Latency of downstream calls up to response headers',
+    ['service', 'operation'],
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+DOWNSTREAM_RESPONSES = Counter(
+    'gateway_downstream_responses_total',
+    'Downstream call outcomes: HTTP status code or transport error class',
+    ['service', 'operation', 'status']
+)
+
+SAGA_STEP_SECONDS = Histogram(
+    'gateway_saga_step_seconds',
+    'Duration of saga steps including retries, by outcome',
+    ['saga', 'step', 'outcome'],
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+SAGA_COMPENSATION_ATTEMPTS = Counter(
+    'gateway_saga_compensation_attempts_total',
+    'Individual compensation attempts of saga steps, by outcome',
+    ['saga', 'step', 'outcome']
+)
+
+SAGAS_IN_FLIGHT = Gauge(
+    'gateway_sagas_in_flight',
+    'Sagas currently executing or compensating in this process',
+    ['saga']
+)
+
+
+class PoolCollector:
+    """
+    Снимает состояние пулов в момент опроса /metrics: соединения httpx по
+    сервисам, пул соединений БД и счетчики кэшей. Сами объекты метрики
+    не знают, поэтому берутся через переданные функции.
+    """
+
+    def __init__(
+        self,
+        clients: Callable[[], dict],
+        db_pool: Callable[[], object] | None = None,
+        caches: Callable[[], list] | None = None
+    ):
+        self._clients = clients
+        self._db_pool = db_pool
+        self._caches = caches
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            'gateway_http_pool_connections',
+            'Connections in the downstream HTTP pool by state',
+            labels = ['service', 'state']
+        )
+        pending = GaugeMetricFamily(
+            'gateway_http_pool_queued_requests',
+            'Requests waiting for a connection from the downstream HTTP pool',
+            labels = ['service']
+        )
+        for name, client in list(self._clients().items()):
+            # Пул httpcore живет во внутреннем транспорте httpx - если устройство
+            # поменяется, метрику просто не отдаем
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)
+            if pool is None:
+                continue
+            pool_connections = list(getattr(pool, 'connections', []))
+            idle = sum(1 for connection in pool_connections if connection.is_idle())
+            connections.add_metric([name, 'idle'], idle)
+            connections.add_metric([name, 'active'], len(pool_connections) - idle)
+            requests = list(getattr(pool, '_requests', []))
+            pending.add_metric([name], sum(1 for request in requests if request.is_queued()))
+        yield connections
+        yield pending
+
+        if self._db_pool is not None:
+            pool = self._db_pool()
+            db = GaugeMetricFamily(
+                'gateway_db_pool_connections',
+                'Connections in the database pool by state',
+                labels = ['state']
+            )
+            db.add_metric(['checked_out'], pool.checkedout())
+            db.add_metric(['checked_in'], pool.checkedin())
+            db.add_metric(['overflow'], max(pool.overflow(), 0))
+            yield db
+            yield GaugeMetricFamily('gateway_db_pool_size', 'Configured size of the database pool', value = pool.size())
+
+        if self._caches is not None:
+            counters = {
+                field: CounterMetricFamily(
+                    f'gateway_cache_{field}',
+                    f'In-process cache {field}',
+                    labels = ['cache']
+                )
+                for field in ('hits', 'misses', 'evictions', 'expirations')
+            }
+            entries = GaugeMetricFamily('gateway_cache_entries', 'Entries in the in-process cache', labels = ['cache'])
+            size = GaugeMetricFamily('gateway_cache_size_bytes', 'Estimated size of the in-process cache', labels = ['cache'])
+            for cache in self._caches():
+                stats = cache.stats()
+                for field, counter in counters.items():
+                    counter.add_metric([stats['name']], stats[field])
+                entries.add_metric([stats['name']], stats['entries'])
+                size.add_metric([stats['name']], stats['size_bytes'])
+            yield from counters.values()
+            yield entries
+            yield size
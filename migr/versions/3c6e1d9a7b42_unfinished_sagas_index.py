@@ -0,0 +1,38 @@
+"""unfinished sagas index
+
+Revision ID: 3c6e1d9a7b42
+Revises: 8ff892d9bfae
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c6e1d9a7b42'
+down_revision: Union[str, Sequence[str], None] = '8ff892d9bfae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_order_sagas_unfinished_last_updated',
+        'order_sagas',
+        ['status', 'last_updated'],
+        unique=False,
+        postgresql_where=sa.text("status = 'UNFINISHED'")
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        'ix_order_sagas_unfinished_last_updated',
+        table_name='order_sagas',
+        postgresql_where=sa.text("status = 'UNFINISHED'")
+    )
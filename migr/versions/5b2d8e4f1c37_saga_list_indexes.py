@@ -0,0 +1,32 @@
+"""saga list indexes
+
+Revision ID: 5b2d8e4f1c37
+Revises: a41f7c2e9d10
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2d8e4f1c37'
+down_revision: Union[str, Sequence[str], None] = 'a41f7c2e9d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_order_sagas_last_updated_id', 'order_sagas', ['last_updated', 'id'], unique=False)
+    op.create_index('ix_order_sagas_status_last_updated_id', 'order_sagas', ['status', 'last_updated', 'id'], unique=False)
+    op.create_index('ix_order_sagas_order_id', 'order_sagas', ['order_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_order_sagas_order_id', table_name='order_sagas')
+    op.drop_index('ix_order_sagas_status_last_updated_id', table_name='order_sagas')
+    op.drop_index('ix_order_sagas_last_updated_id', table_name='order_sagas')
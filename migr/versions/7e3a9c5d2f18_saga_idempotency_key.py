@@ -0,0 +1,28 @@
+"""saga idempotency key
+
+Revision ID: 7e3a9c5d2f18
+Revises: 5b2d8e4f1c37
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e3a9c5d2f18'
+down_revision: Union[str, Sequence[str], None] = '5b2d8e4f1c37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('order_sagas', sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('order_sagas', 'idempotency_key')
@@ -0,0 +1,29 @@
+"""saga payload
+
+Revision ID: a41f7c2e9d10
+Revises: 3c6e1d9a7b42
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f7c2e9d10'
+down_revision: Union[str, Sequence[str], None] = '3c6e1d9a7b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('order_sagas', sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('order_sagas', 'payload')
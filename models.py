@@ -191,6 +191,14 @@ class StockReturn(ID, StockBase, CreatedAt, LastChanged):
     available: int
     class Config:
         from_attributes = True
+
+class StockLookup(BaseModel):
+    good_ids: List[UUID] = Field(min_length = 1)
+
+class StockLookupReturn(BaseModel):
+    # Остатки по найденным товарам и причина отказа по остальным
+    stocks: dict[UUID, StockReturn] = {}
+    errors: dict[UUID, str] = {}
 # _________________________________________________________
 
 
@@ -270,6 +278,27 @@ class SagaReturn(ID):
     last_updated: datetime
 
 
+class SagaExportRow(SagaReturn):
+    # Передать в cursor, чтобы продолжить выгрузку после этой строки
+    cursor: str
+
+
+class SagaAcceptedReturn(BaseModel):
+    saga_id: UUID
+    status: str
+
+
+class OrderDetailsReturn(BaseModel):
+    # Страница заказа за один запрос: части, которые не удалось получить,
+    # остаются пустыми, а причина лежит в errors под именем части
+    order: OrderReturn
+    notifications: List[NotificationReturn] | None = None
+    delivery: DeliveryReturn | None = None
+    reservation: ReservationReturn | None = None
+    saga: SagaReturn | None = None
+    errors: dict[str, str] = {}
+
+
 class OrderCreateStatusReturn(BaseModel):
     id: UUID | None = None
     error: str | None = None
@@ -0,0 +1,38 @@
+from fastapi import HTTPException, status
+from datetime import datetime, timezone
+from uuid import UUID
+import base64
+
+
+def naive_utc(
+    value: datetime | None
+) -> datetime | None:
+    # last_updated хранится как naive UTC; aware-время (…Z, +03:00) asyncpg с такой
+    # колонкой не сравнит, поэтому приводим его к UTC и снимаем зону
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo = None)
+
+
+# Курсор keyset-пагинации саг: позиция последней отданной строки в порядке (last_updated, id)
+def encode_cursor(
+    last_updated: datetime,
+    saga_id: UUID
+) -> str:
+    raw = f'{last_updated.isoformat()}|{saga_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(
+    cursor: str
+) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        last_updated, saga_id = raw.split('|', 1)
+        return naive_utc(datetime.fromisoformat(last_updated)), UUID(saga_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code = status.HTTP_400_BAD_REQUEST,
+            detail = 'Invalid cursor'
+        )
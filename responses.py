@@ -0,0 +1,32 @@
+from fastapi import Response
+from config import settings
+import pydantic_core
+
+
+class ModelResponse(Response):
+    """
+    JSON-ответ из уже собранных моделей (или списков и словарей моделей).
+
+    Сериализуется pydantic-core сразу в байты, как model_dump_json. FastAPI не
+    прогоняет Response через response_model, поэтому модель не валидируется
+    второй раз, а response_model в декораторе остается только для OpenAPI.
+    """
+
+    media_type = 'application/json'
+
+    def render(
+        self,
+        content
+    ) -> bytes:
+        return pydantic_core.to_json(content)
+
+
+def model_response(
+    content,
+    status_code: int = 200
+):
+    # Только для моделей, собранных в utils из провалидированных данных:
+    # ORM-объекты и словари по-прежнему должны проходить через response_model
+    if not settings.responses.fast:
+        return content
+    return ModelResponse(content, status_code = status_code)
@@ -2,72 +2,89 @@ from models import UserCreate, ProfileReturn
 from service_auth import AuthService
 from service_profile import ProfileService
 from service_billing import BillingService
+from service import Service
+from saga_engine import Saga, SagaStep, SagaContext
+import uuid
+import logging
 
 
+log = logging.getLogger(__name__)
+
 class SagaRegister():
 
     def __init__(self):
-        self.__auth_created    = False
-        self.__profile_created = False
-        self.__wallet_created  = False
+        self.__auth_service    = AuthService()
+        self.__profile_service = ProfileService()
+        self.__billing_service = BillingService()
+
+        self.__saga = Saga('register', [
+            SagaStep('auth', self._create_auth, self._delete_auth),
+            SagaStep('profile', self._create_profile, self._delete_profile, depends_on = ('auth',)),
+            # Удалить кошелек billing не умеет, поэтому он создается последним,
+            # когда откатывать после него уже нечего
+            SagaStep('wallet', self._create_wallet, depends_on = ('profile',)),
+        ])
 
     async def execute_saga(
         self,
         reg_data: UserCreate
     ):
-        auth_service    = AuthService()
-        profile_service = ProfileService()
-        billing_service = BillingService()
-
-        try:            
-            auth_response = await auth_service.create_auth(reg_data.username, reg_data.password)
-            self.__auth_created = True
-
-            profile_response = await profile_service.create_profile(reg_data.username,
-                                                                    reg_data.firstName,
-                                                                    reg_data.lastName,
-                                                                    reg_data.email,
-                                                                    reg_data.phone)
-            self.__profile_created = True
+        Service.ensure_available(
+            AuthService._name,
+            ProfileService._name,
+            BillingService._name
+        )
 
-            billing_response = await billing_service.create_wallet(reg_data.username)
-            self.__wallet_created = True
+        ctx = SagaContext(uuid.uuid4(), reg_data)
 
+        try:
+            await self.__saga.execute(ctx)
         except Exception as e:
-            print('Ошибка при регистрации: ' + str(e))
-            await self.rollback_saga(reg_data)
+            log.warning('Ошибка при регистрации', extra = {'saga_id': ctx.saga_id, 'error': str(e)})
+            if ctx.compensation_error is not None:
+                log.error('Ошибка при откате регистрации', extra = {'saga_id': ctx.saga_id, 'error': str(ctx.compensation_error)})
             raise
 
-        json = profile_response.json()
-        return ProfileReturn(
-            username  = json.get("username"),
-            email     = json.get("email"),
-            phone     = json.get("phone"),
-            firstName = json.get("firstName"),
-            lastName  = json.get("lastName")
-        )
+        return ctx.results['profile']
 
 
-    async def rollback_saga(
+    async def _create_auth(
         self,
-        reg_data: UserCreate
+        ctx: SagaContext
     ):
-        auth_service    = AuthService()
-        profile_service = ProfileService()
-        billing_service = BillingService()
+        reg_data = ctx.data
+        return await self.__auth_service.create_auth(reg_data.username, reg_data.password)
 
-        try:
-            if self.__wallet_created:
-                billing_response = billing_service.delete_wallet(reg_data.username)
-                self.__wallet_created = False
-            if self.__profile_created:
-                profile_response = await profile_service.delete_profile(reg_data.username)
-                self.__profile_created = False
-            if self.__auth_created:
-                auth_response = await auth_service.delete_auth(reg_data.username)
-                self.__auth_created = False
-        except Exception as e:
-            print('Ошибка при откате регистрации: ' + str(e))
-            raise
+
+    async def _delete_auth(
+        self,
+        ctx: SagaContext
+    ):
+        await self.__auth_service.delete_auth(ctx.data.username)
+
+
+    async def _create_profile(
+        self,
+        ctx: SagaContext
+    ):
+        reg_data = ctx.data
+        response = await self.__profile_service.create_profile(reg_data.username,
+                                                               reg_data.firstName,
+                                                               reg_data.lastName,
+                                                               reg_data.email,
+                                                               reg_data.phone)
+        return Service.decode(response, ProfileReturn)
 
 
+    async def _delete_profile(
+        self,
+        ctx: SagaContext
+    ):
+        await self.__profile_service.delete_profile(ctx.data.username)
+
+
+    async def _create_wallet(
+        self,
+        ctx: SagaContext
+    ):
+        return await self.__billing_service.create_wallet(ctx.data.username)
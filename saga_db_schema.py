@@ -1,6 +1,6 @@
-from sqlalchemy import Column, DateTime, Boolean, Enum as SQLEnum
+from sqlalchemy import Column, DateTime, Boolean, Index, String, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 import uuid
 from datetime import datetime
@@ -37,4 +37,21 @@ class SagaOrder(Base):
     status = Column(SQLEnum(SagaStatus), nullable=False, default=SagaStatus.UNFINISHED)
     # Метка времени, чтобы отделять зависшие саги от идущих здесь и сейчас в потенциальном "разгребателе" 
     last_updated = Column(DateTime, nullable=False, default=datetime.utcnow())
-
+    # Данные заказа для асинхронного режима: по ним воркер (или разгребатель) продолжает сагу
+    payload = Column(JSONB, nullable=True)
+    # Основа ключей идемпотентности прямых шагов: ключ шага = "<основа>:<шаг>"
+    idempotency_key = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        # Разгребателю нужны только незавершенные саги, отсортированные по last_updated
+        Index(
+            'ix_order_sagas_unfinished_last_updated',
+            'status',
+            'last_updated',
+            postgresql_where = (status == SagaStatus.UNFINISHED)
+        ),
+        # Keyset-пагинация GET /sagas по (last_updated, id), с фильтром по статусу и без
+        Index('ix_order_sagas_last_updated_id', 'last_updated', 'id'),
+        Index('ix_order_sagas_status_last_updated_id', 'status', 'last_updated', 'id'),
+        Index('ix_order_sagas_order_id', 'order_id'),
+    )
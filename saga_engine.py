@@ -0,0 +1,340 @@
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+from metrics import SAGA_STEP_SECONDS, SAGA_COMPENSATION_ATTEMPTS, SAGAS_IN_FLIGHT
+import asyncio
+import deadline
+import tracing
+import logging
+import random
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+def _retry_any(
+    error: Exception
+) -> bool:
+    return True
+
+
+@dataclass
+class RetryPolicy:
+    # Экспоненциальная задержка base_delay * 2^attempt, не больше max_delay,
+    # с разбросом +-jitter (доля от задержки)
+    max_attempts: int = 1
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    jitter: float = 0.0
+    retry_on: Callable[[Exception], bool] = _retry_any
+
+    def delay(
+        self,
+        attempt: int
+    ) -> float:
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return max(delay, 0.0)
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        timeout: float | None = None
+    ):
+        for attempt in range(self.max_attempts):
+            deadline.check()
+            try:
+                # Попытка не может пережить срок запроса
+                attempt_timeout = deadline.bound(timeout)
+                if attempt_timeout is None:
+                    return await func()
+                return await asyncio.wait_for(func(), attempt_timeout)
+            except Exception as e:
+                if isinstance(e, TimeoutError) and deadline.expired():
+                    raise deadline.DeadlineExceeded() from e
+                if attempt >= self.max_attempts - 1 or not self.retry_on(e):
+                    raise
+                delay = self.delay(attempt)
+                left = deadline.remaining()
+                if left is not None and left <= delay:
+                    # До следующей попытки срок уже истечет
+                    raise
+                await asyncio.sleep(delay)
+
+
+@dataclass
+class SagaStep:
+    name: str
+    action: Callable[['SagaContext'], Awaitable[Any]]
+    compensation: Callable[['SagaContext'], Awaitable[Any]] | None = None
+    depends_on: tuple = ()
+    retry: RetryPolicy = field(default_factory = RetryPolicy)
+    compensation_retry: RetryPolicy = field(default_factory = lambda: RetryPolicy(max_attempts = 3, base_delay = 1.0))
+    # Таймаут одной попытки шага, в секундах
+    timeout: float | None = None
+
+
+@dataclass
+class SagaContext:
+    saga_id: Any
+    data: Any = None
+    # Результаты выполненных шагов: имя шага -> то, что вернул action
+    results: dict = field(default_factory = dict)
+    compensated: set = field(default_factory = set)
+    error: Exception | None = None
+    compensation_error: Exception | None = None
+    # Основа ключей идемпотентности шагов, по умолчанию - id саги
+    idempotency_key: str | None = None
+
+    @property
+    def completed(self) -> set:
+        return set(self.results)
+
+    def step_key(
+        self,
+        step_name: str
+    ) -> str:
+        # Один и тот же ключ на все попытки шага, в том числе после восстановления саги
+        return f'{self.idempotency_key or self.saga_id}:{step_name}'
+
+
+class SagaStore:
+    """
+    Куда сага пишет свой прогресс. Базовая реализация ничего не хранит -
+    прогресс живет только в SagaContext (подходит для саг без восстановления).
+    """
+
+    async def step_completed(
+        self,
+        ctx: SagaContext,
+        step: SagaStep,
+        result
+    ):
+        pass
+
+    async def step_compensated(
+        self,
+        ctx: SagaContext,
+        step: SagaStep
+    ):
+        pass
+
+    async def saga_completed(
+        self,
+        ctx: SagaContext
+    ):
+        pass
+
+    async def saga_cancelled(
+        self,
+        ctx: SagaContext
+    ):
+        pass
+
+
+class Saga:
+    """
+    Декларативная сага: шаги с зависимостями, компенсациями и политиками повторов.
+
+    Шаги выполняются волнами: в волну попадают все шаги, чьи зависимости уже
+    выполнены, и они идут параллельно. Если хоть один шаг упал, соседи по волне
+    доделываются (их результат тоже надо будет откатить), после чего выполненные
+    шаги компенсируются в обратном порядке и исходная ошибка пробрасывается.
+    Уже выполненные (по контексту) шаги повторно не запускаются - так сага
+    продолжается после сбоя.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        steps: list
+    ):
+        self.name = name
+        self.steps = {step.name: step for step in steps}
+        self.waves = self.__build_waves(steps)
+
+    @staticmethod
+    def __build_waves(
+        steps: list
+    ) -> list:
+        names = {step.name for step in steps}
+        for step in steps:
+            for dep in step.depends_on:
+                if dep not in names:
+                    raise ValueError(f'Step {step.name} depends on unknown step {dep}')
+
+        waves = []
+        placed = set()
+        pending = list(steps)
+        while pending:
+            wave = [step for step in pending if all(dep in placed for dep in step.depends_on)]
+            if not wave:
+                raise ValueError('Saga steps contain a dependency cycle')
+            waves.append(wave)
+            placed.update(step.name for step in wave)
+            pending = [step for step in pending if step.name not in placed]
+        return waves
+
+    async def execute(
+        self,
+        ctx: SagaContext,
+        store: SagaStore | None = None
+    ) -> SagaContext:
+        # Шаги и компенсации - дочерние спаны саги
+        with SAGAS_IN_FLIGHT.labels(self.name).track_inprogress():
+            with tracing.span(f'saga.{self.name}', attributes = {'saga.id': ctx.saga_id}):
+                return await self.__execute(ctx, store or SagaStore())
+
+    async def __execute(
+        self,
+        ctx: SagaContext,
+        store: SagaStore
+    ) -> SagaContext:
+        # Стор может держать одну сессию БД, а она не терпит параллельных запросов
+        store_lock = asyncio.Lock()
+
+        try:
+            for wave in self.waves:
+                todo = [step for step in wave if step.name not in ctx.results]
+                if not todo:
+                    continue
+
+                # Бюджет потрачен - дальше не идем, откатываем сделанное
+                deadline.check()
+
+                # Шаг не бросает исключение наружу, а возвращает его: упавший шаг не
+                # должен отменять соседей посреди вызова, иначе созданное ими внизу
+                # не попадет в стор и не будет откачено
+                async with asyncio.TaskGroup() as tg:
+                    tasks = [
+                        tg.create_task(self.__run_step(step, ctx, store, store_lock))
+                        for step in todo
+                    ]
+
+                errors = [task.result() for task in tasks if task.result() is not None]
+                if errors:
+                    raise errors[0]
+
+            await store.saga_completed(ctx)
+        except Exception as e:
+            ctx.error = e
+            try:
+                await self.__compensate_all(ctx, store)
+            except Exception as compensation_error:
+                # Наружу уходит исходная причина, ошибка отката остается в контексте
+                ctx.compensation_error = compensation_error
+            raise
+
+        return ctx
+
+    async def __run_step(
+        self,
+        step: SagaStep,
+        ctx: SagaContext,
+        store: SagaStore,
+        store_lock: asyncio.Lock
+    ):
+        with tracing.span(f'saga.{self.name}.{step.name}', attributes = {'saga.id': ctx.saga_id}) as current:
+            start = time.monotonic()
+            try:
+                result = await step.retry.call(lambda: step.action(ctx), step.timeout)
+                ctx.results[step.name] = result
+                async with store_lock:
+                    await store.step_completed(ctx, step, result)
+            except Exception as e:
+                # Ошибка шага возвращается, а не летит из спана - помечаем вручную
+                tracing.set_error(current, str(e), e)
+                SAGA_STEP_SECONDS.labels(self.name, step.name, 'failed').observe(time.monotonic() - start)
+                log.warning('Шаг саги не выполнен', extra = {
+                    'saga': self.name,
+                    'saga_id': ctx.saga_id,
+                    'step': step.name,
+                    'duration': round(time.monotonic() - start, 4),
+                    'error': str(e)
+                })
+                return e
+            SAGA_STEP_SECONDS.labels(self.name, step.name, 'completed').observe(time.monotonic() - start)
+            if log.isEnabledFor(logging.INFO):
+                log.info('Шаг саги выполнен', extra = {
+                    'saga': self.name,
+                    'saga_id': ctx.saga_id,
+                    'step': step.name,
+                    'duration': round(time.monotonic() - start, 4)
+                })
+            return None
+
+    async def compensate(
+        self,
+        ctx: SagaContext,
+        store: SagaStore | None = None
+    ):
+        with SAGAS_IN_FLIGHT.labels(self.name).track_inprogress():
+            await self.__compensate_all(ctx, store or SagaStore())
+
+    async def __compensate_all(
+        self,
+        ctx: SagaContext,
+        store: SagaStore
+    ):
+        # Компенсации обязаны доделаться, даже если бюджет запроса уже потрачен
+        with deadline.no_deadline():
+            await self.__compensate(ctx, store)
+
+    async def __compensation_attempt(
+        self,
+        step: SagaStep,
+        ctx: SagaContext
+    ):
+        # Считаем каждую попытку отдельно: повторы компенсаций видны в метриках
+        try:
+            result = await step.compensation(ctx)
+        except Exception:
+            SAGA_COMPENSATION_ATTEMPTS.labels(self.name, step.name, 'failed').inc()
+            raise
+        SAGA_COMPENSATION_ATTEMPTS.labels(self.name, step.name, 'succeeded').inc()
+        return result
+
+    async def __compensate(
+        self,
+        ctx: SagaContext,
+        store: SagaStore
+    ):
+        errors = []
+
+        for wave in reversed(self.waves):
+            for step in wave:
+                if step.name not in ctx.results or step.name in ctx.compensated:
+                    continue
+                start = time.monotonic()
+                try:
+                    with tracing.span(f'saga.{self.name}.{step.name}.compensate', attributes = {'saga.id': ctx.saga_id}):
+                        if step.compensation is not None:
+                            await step.compensation_retry.call(lambda: self.__compensation_attempt(step, ctx))
+                        ctx.compensated.add(step.name)
+                        await store.step_compensated(ctx, step)
+                except Exception as e:
+                    # Остальные шаги все равно откатываем, сага останется незавершенной
+                    SAGA_STEP_SECONDS.labels(self.name, step.name, 'compensation_failed').observe(time.monotonic() - start)
+                    log.error('Шаг саги не откачен', extra = {
+                        'saga': self.name,
+                        'saga_id': ctx.saga_id,
+                        'step': step.name,
+                        'duration': round(time.monotonic() - start, 4),
+                        'error': str(e)
+                    })
+                    errors.append(e)
+                    continue
+                SAGA_STEP_SECONDS.labels(self.name, step.name, 'compensated').observe(time.monotonic() - start)
+                if log.isEnabledFor(logging.INFO):
+                    log.info('Шаг саги откачен', extra = {
+                        'saga': self.name,
+                        'saga_id': ctx.saga_id,
+                        'step': step.name,
+                        'duration': round(time.monotonic() - start, 4)
+                    })
+
+        if errors:
+            raise errors[0]
+
+        await store.saga_cancelled(ctx)
@@ -1,250 +1,367 @@
-from models import OrderCreate, OrderReturn, OrderCreateStatusReturn
+from models import OrderCreate, OrderCreateStatusReturn
 from service_billing import BillingService
 from service_order import OrderService
 from service_delivery import DeliveryService
 from service_warehouse import WarehouseService
+from service import Service, is_transient
+from config import settings
 from uuid import UUID
 from decimal import Decimal
 from saga_db_schema import SagaOrder as SagaOrder_DB, SagaStatus
+from saga_engine import Saga, SagaStep, SagaContext, SagaStore, RetryPolicy
 import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException, status
 from datetime import datetime
-import asyncio
-from sqlalchemy.ext.asyncio import async_sessionmaker
-from sqlalchemy import select, and_, func
-from sqlalchemy.future import select
+from sqlalchemy import update
+import tracing
+import logging
 
 
-class SagaOrder:
-    def __init__(self):
-        self.__order_id = None
-        self.__payment_id = None
-        self.__order_status_set = False
-        self.__reservation_id = None
-        self.__delivery_id = None
+log = logging.getLogger(__name__)
+
+
+class OrderSagaStore(SagaStore):
+    """
+    Прогресс саги заказа в таблице order_sagas: по строке на сагу,
+    на каждый шаг - id созданной сущности и флаг ее отмены.
+    """
 
+    # Шаг -> (колонка с id, колонка флага отмены)
+    STEP_COLUMNS = {
+        'order':       ('order_id', 'order_cancelled'),
+        'payment':     ('payment_id', 'payment_cancelled'),
+        'reservation': ('reservation_id', 'reservation_cancelled'),
+        'delivery':    ('delivery_id', 'delivery_cancelled'),
+    }
 
-    async def __init_new_saga(
+    def __init__(
         self,
         db: AsyncSession
     ):
+        self.db = db
+
+
+    @staticmethod
+    def idempotency_key(
+        saga_id: UUID
+    ) -> str:
+        return f'order-saga:{saga_id}'
+
+
+    async def create(
+        self,
+        payload: dict | None = None
+    ) -> UUID:
+        return (await self.create_row(payload)).id
+
+
+    async def create_row(
+        self,
+        payload: dict | None = None
+    ) -> SagaOrder_DB:
+        saga_id = uuid.uuid4()
         new_saga = SagaOrder_DB(
-            id = uuid.uuid4(),
+            id = saga_id,
             status = SagaStatus.UNFINISHED,
-            last_updated = datetime.utcnow()
+            last_updated = datetime.utcnow(),
+            payload = payload,
+            idempotency_key = self.idempotency_key(saga_id)
         )
 
-        db.add(new_saga)
+        self.db.add(new_saga)
 
         try:
-            await db.commit()
-            id = new_saga.id
-            result = await db.execute(
-                select(SagaOrder_DB)
-                .filter(SagaOrder_DB.id == id)
-                .with_for_update()
-            )
-            new_saga = result.scalar_one_or_none()
+            with tracing.span('order_sagas.insert', attributes = {'saga.id': saga_id}):
+                await self.db.commit()
         except IntegrityError:
-            await db.rollback()
+            await self.db.rollback()
             raise HTTPException(status_code = status.HTTP_500_INTERNAL_SERVER_ERROR, detail = 'Failed to create new order')
         except Exception as e:
-            print(f"=== EXCEPTION ===")
-            print(f"Type: {type(e).__name__}")
-            print(f"Message: {e}")
-            # Самое важное:
-            print(f"ORIG: {e.orig}") 
-            await db.rollback()
+            # Самое важное - orig, исходная ошибка драйвера БД
+            log.exception('Не удалось записать сагу', extra = {'saga_id': saga_id, 'orig': getattr(e, 'orig', None)})
+            await self.db.rollback()
             raise
         return new_saga
-    
 
-    async def __update_db_saga(
+
+    async def _update(
         self,
-        db: AsyncSession,
-        saga: SagaOrder_DB,
+        saga_id: UUID,
+        **changes
     ):
-        # if order_id is not None:
-        #     saga.order_id = order_id
-        # if order_cancelled is not None:
-        #     saga.order_cancelled = order_cancelled
-        # if payment_id is not None:
-        #     saga.payment_id = payment_id
-        # if payment_cancelled is not None:
-        #     saga.payment_cancelled = payment_cancelled
-        # if reservation_id is not None:
-        #     saga.reservation_id = reservation_id
-        # if reservation_cancelled is not None:
-        #     saga.reservation_cancelled = reservation_cancelled
-        # if delivery_id is not None:
-        #     saga.delivery_id = delivery_id
-        # if delivery_cancelled is not None:
-        #     saga.delivery_cancelled = delivery_cancelled
-        saga.last_updated = datetime.utcnow()
-        await db.commit()
-        id = saga.id
-        saga = await db.execute(
-            select(SagaOrder_DB)
-            .filter(SagaOrder_DB.id == id)
-            .with_for_update()
-        )
-        
-        return saga
+        # Один точечный UPDATE только по изменившимся колонкам, без повторного SELECT
+        changes['last_updated'] = datetime.utcnow()
+        try:
+            with tracing.span('order_sagas.update', attributes = {'saga.id': saga_id, 'db.columns': ','.join(sorted(changes))}):
+                await self.db.execute(
+                    update(SagaOrder_DB)
+                    .where(SagaOrder_DB.id == saga_id)
+                    .values(**changes)
+                )
+                await self.db.commit()
+        except Exception:
+            # Сессия должна остаться пригодной для записи хода компенсации
+            await self.db.rollback()
+            raise
 
-    
-    async def execute_saga(
+
+    async def step_completed(
         self,
-        order_data: OrderCreate,
-        db: AsyncSession
+        ctx: SagaContext,
+        step: SagaStep,
+        result
     ):
-        # Запишем новую сагу в БД (чтобы была возможность потом отследить недобитые саги)
-        new_saga = await self.__init_new_saga(db)
+        columns = self.STEP_COLUMNS.get(step.name)
+        if columns is not None:
+            await self._update(ctx.saga_id, **{columns[0]: result})
 
-        order_service = OrderService()
-        billing_service = BillingService()
-        warehouse_service = WarehouseService()
-        delivery_service = DeliveryService()
 
-        result = OrderCreateStatusReturn()
+    async def step_compensated(
+        self,
+        ctx: SagaContext,
+        step: SagaStep
+    ):
+        columns = self.STEP_COLUMNS.get(step.name)
+        if columns is not None:
+            await self._update(ctx.saga_id, **{columns[1]: True})
 
-        try:
-            # Если кто-то из сервисов недоступен - сага провалена и должна откатиться
-            order_response = await order_service.create_order(order_data.username, order_data.price)
-            new_saga.order_id = order_response.json().get('id')
-            new_saga = await self.__update_db_saga(db, new_saga)
 
-            tr_amount = -Decimal(order_data.price)
-            billing_response = await billing_service.create_transaction(order_data.username, tr_amount)
-            new_saga.payment_id = billing_response.json().get('id')
-            new_saga = await self.__update_db_saga(db, new_saga)
+    async def saga_completed(
+        self,
+        ctx: SagaContext
+    ):
+        await self._update(ctx.saga_id, status = SagaStatus.COMPLETED)
+
+
+    async def saga_cancelled(
+        self,
+        ctx: SagaContext
+    ):
+        await self._update(ctx.saga_id, status = SagaStatus.CANCELLED)
+
+
+    @classmethod
+    def context_from_row(
+        cls,
+        saga: SagaOrder_DB,
+        order_data: OrderCreate | None = None
+    ) -> SagaContext:
+        # У саг, созданных до появления ключей, основа выводится из id так же
+        ctx = SagaContext(
+            saga.id,
+            order_data,
+            idempotency_key = saga.idempotency_key or cls.idempotency_key(saga.id)
+        )
+        for step_name, (id_column, cancelled_column) in cls.STEP_COLUMNS.items():
+            step_id = getattr(saga, id_column)
+            if step_id is not None:
+                ctx.results[step_name] = step_id
+            if getattr(saga, cancelled_column):
+                ctx.compensated.add(step_name)
+        return ctx
+
+
+class SagaOrder:
+
+    def __init__(self):
+        self.__order_service = OrderService()
+        self.__billing_service = BillingService()
+        self.__warehouse_service = WarehouseService()
+        self.__delivery_service = DeliveryService()
+
+        # Прямые шаги идут с ключом идемпотентности, поэтому временную ошибку
+        # безопасно повторить, а не откатывать из-за нее весь заказ
+        retry = settings.saga_retry
+        forward_retry = RetryPolicy(
+            max_attempts = retry.attempts,
+            base_delay = retry.base_delay,
+            max_delay = retry.max_delay,
+            jitter = retry.jitter,
+            retry_on = is_transient
+        )
+
+        # Оплата, резерв и доставка зависят только от заказа и идут параллельно
+        self.saga = Saga('order', [
+            SagaStep('order', self._create_order, self._cancel_order, retry = forward_retry),
+            SagaStep('payment', self._create_payment, self._cancel_payment, depends_on = ('order',), retry = forward_retry),
+            SagaStep('reservation', self._create_reservation, self._cancel_reservation, depends_on = ('order',), retry = forward_retry),
+            SagaStep('delivery', self._create_delivery, self._cancel_delivery, depends_on = ('order',), retry = forward_retry),
+            SagaStep('payment_confirmed', self._confirm_payment, depends_on = ('payment', 'reservation', 'delivery')),
+        ])
+
 
-            warehouse_response = await warehouse_service.create_reservation(new_saga.order_id, order_data.positions)
-            new_saga.reservation_id = warehouse_response.json().get('id')
-            new_saga = await self.__update_db_saga(db, new_saga)
+    def __ensure_available(self):
+        # Если кто-то из участников заведомо недоступен - отказываем до записи саги в БД
+        Service.ensure_available(
+            OrderService._name,
+            BillingService._name,
+            WarehouseService._name,
+            DeliveryService._name
+        )
 
-            delivery_response = await delivery_service.create_delivery(new_saga.order_id, order_data.address)
-            new_saga.delivery_id = delivery_response.json().get('id')
-            new_saga = await self.__update_db_saga(db, new_saga)
 
-            status_response = await order_service.payment_confirmed(new_saga.order_id, new_saga.payment_id)
-            new_saga.status = SagaStatus.COMPLETED
-            new_saga = await self.__update_db_saga(db, new_saga)
+    async def __drive(
+        self,
+        ctx: SagaContext,
+        store: OrderSagaStore
+    ):
+        result = OrderCreateStatusReturn()
 
+        try:
+            # Если кто-то из сервисов недоступен - сага провалена и откатится внутри
+            await self.saga.execute(ctx, store)
         except Exception as e:
             result.error = f'Ошибка при оформлении заказа: {e}'
-            print(result.error)
-            await self.rollback_saga(new_saga.id, order_data, db)
-            # raise
+            log.warning('Ошибка при оформлении заказа', extra = {'saga_id': ctx.saga_id, 'error': str(e)})
+            if ctx.compensation_error is not None:
+                log.error('Ошибка при откате заказа', extra = {'saga_id': ctx.saga_id, 'error': str(ctx.compensation_error)})
 
-        if not new_saga.order_id is None:
-            result.id = new_saga.order_id
+        result.id = ctx.results.get('order')
 
         return result
 
 
+    async def execute_saga(
+        self,
+        order_data: OrderCreate,
+        db: AsyncSession
+    ):
+        self.__ensure_available()
+
+        store = OrderSagaStore(db)
+
+        # Запишем новую сагу в БД (чтобы была возможность потом отследить недобитые саги)
+        saga_id = await store.create()
+
+        ctx = SagaContext(saga_id, order_data, idempotency_key = store.idempotency_key(saga_id))
+
+        return await self.__drive(ctx, store)
 
-    async def rollback_saga(
+
+    async def submit_saga(
         self,
-        saga_id: UUID,
         order_data: OrderCreate,
         db: AsyncSession
+    ) -> SagaOrder_DB:
+        # Асинхронный режим: сохраняем намерение вместе с данными заказа,
+        # выполнять сагу будет пул воркеров (или разгребатель после сбоя).
+        # last_updated новой строки - отметка "еще никем не взята" для claim_saga
+        self.__ensure_available()
+
+        store = OrderSagaStore(db)
+
+        return await store.create_row(payload = order_data.model_dump(mode = 'json'))
+
+
+    async def recover_saga(
+        self,
+        saga: SagaOrder_DB,
+        db: AsyncSession
+    ):
+        # Если данные заказа сохранены и откат еще не начинался - сагу можно
+        # продолжить с первого невыполненного шага, иначе только откатить
+        if saga.payload is not None and not any(getattr(saga, cancelled) for _, cancelled in OrderSagaStore.STEP_COLUMNS.values()):
+            order_data = OrderCreate.model_validate(saga.payload)
+            ctx = OrderSagaStore.context_from_row(saga, order_data)
+            return await self.__drive(ctx, OrderSagaStore(db))
+
+        await self.compensate_saga(saga, db)
+        return None
+
+
+    async def compensate_saga(
+        self,
+        saga: SagaOrder_DB,
+        db: AsyncSession
     ):
-        
-        async_session_factory = db.bind.registry 
+        # Откат саги по ее строке в БД, без исходных данных заказа
+        ctx = OrderSagaStore.context_from_row(saga)
+        await self.saga.compensate(ctx, OrderSagaStore(db))
+
 
-        await asyncio.create_task(
-            self._perform_rollback_with_retries_per_step(saga_id, order_data, async_session_factory)
+    async def _create_order(
+        self,
+        ctx: SagaContext
+    ):
+        order_data = ctx.data
+        response = await self.__order_service.create_order(
+            order_data.username,
+            order_data.price,
+            idempotency_key = ctx.step_key('order')
         )
+        return Service.decode_id(response)
 
-    async def _perform_rollback_with_retries_per_step(
+
+    async def _cancel_order(
         self,
-        saga_id: UUID,
-        order_data: OrderCreate,
-        session_factory: async_sessionmaker,
-        max_retries: int = 3,
-        base_delay: float = 1.0
-    ):
-        async with session_factory() as db:
-            # Загружаем сагу для отката
-            result = await db.execute(
-                select(SagaOrder_DB)
-                .filter(SagaOrder_DB.id == saga_id)
-                .with_for_update()
-            )
-            saga = result.scalar_one_or_none()
-
-            if saga is None:
-                print("Сага не найдена для отката.")
-                return
-
-            # Откатываем каждый шаг с повторными попытками
-            if not saga.delivery_cancelled:
-                delivery_service = DeliveryService()
-                
-                await self._retry_rollback_step(
-                    lambda: delivery_service.cancel_delivery(saga.delivery_id),
-                    "доставки",
-                    max_retries=max_retries,
-                    base_delay=base_delay
-                )
-                saga.delivery_cancelled = True
-                saga = await self.__update_db_saga(db, saga)
-
-            if not saga.reservation_cancelled:
-                warehouse_service = WarehouseService()               
-                await self._retry_rollback_step(
-                    lambda: warehouse_service.cancel_reservation(saga.reservation_id),
-                    "резервации",
-                    max_retries=max_retries,
-                    base_delay=base_delay
-                )
-                saga.reservation_cancelled = True
-                saga = await self.__update_db_saga(db, saga) 
-
-            if not saga.payment_cancelled:
-                billing_service = BillingService()
-                await self._retry_rollback_step(
-                    lambda: billing_service.storno_transaction(saga.payment_id),
-                    "платежа",
-                    max_retries=max_retries,
-                    base_delay=base_delay
-                )
-                saga.payment_cancelled = True
-                saga = await self.__update_db_saga(db, saga) 
-
-            if not saga.order_cancelled and saga.status != SagaStatus.COMPLETED:
-                order_service = OrderService()
-                await self._retry_rollback_step(
-                    lambda: order_service.payment_failed(saga.order_id),
-                    "статуса заказа",
-                    max_retries=max_retries,
-                    base_delay=base_delay
-                )
-                saga.order_cancelled = True
-                saga.status = SagaStatus.CANCELLED
-                saga = await self.__update_db_saga(db, saga)
-
-
-    async def _retry_rollback_step(
-        self,
-        step_func: callable,
-        step_name: str,
-        max_retries: int = 3,
-        base_delay: float = 1.0
-    ):
-        for attempt in range(max_retries):
-            try:
-                await step_func()
-                print(f"Откат {step_name} выполнен успешно.")
-                break
-            except Exception as e:
-                print(f"Ошибка при откате {step_name} (попытка {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    delay = base_delay * (2 ** attempt)
-                    print(f"Ждём {delay} секунд перед повторной попыткой отката {step_name}...")
-                    await asyncio.sleep(delay)
-                else:
-                    print(f"Все попытки отката {step_name} исчерпаны.")
-                    raise
\ No newline at end of file
+        ctx: SagaContext
+    ):
+        await self.__order_service.payment_failed(ctx.results['order'])
+
+
+    async def _create_payment(
+        self,
+        ctx: SagaContext
+    ):
+        order_data = ctx.data
+        tr_amount = -Decimal(order_data.price)
+        response = await self.__billing_service.create_transaction(
+            order_data.username,
+            tr_amount,
+            idempotency_key = ctx.step_key('payment')
+        )
+        return Service.decode_id(response)
+
+
+    async def _cancel_payment(
+        self,
+        ctx: SagaContext
+    ):
+        await self.__billing_service.storno_transaction(ctx.results['payment'])
+
+
+    async def _create_reservation(
+        self,
+        ctx: SagaContext
+    ):
+        response = await self.__warehouse_service.create_reservation(
+            ctx.results['order'],
+            ctx.data.positions,
+            idempotency_key = ctx.step_key('reservation')
+        )
+        return Service.decode_id(response)
+
+
+    async def _cancel_reservation(
+        self,
+        ctx: SagaContext
+    ):
+        await self.__warehouse_service.cancel_reservation(ctx.results['reservation'])
+
+
+    async def _create_delivery(
+        self,
+        ctx: SagaContext
+    ):
+        response = await self.__delivery_service.create_delivery(
+            ctx.results['order'],
+            ctx.data.address,
+            idempotency_key = ctx.step_key('delivery')
+        )
+        return Service.decode_id(response)
+
+
+    async def _cancel_delivery(
+        self,
+        ctx: SagaContext
+    ):
+        await self.__delivery_service.cancel_delivery(ctx.results['delivery'])
+
+
+    async def _confirm_payment(
+        self,
+        ctx: SagaContext
+    ):
+        await self.__order_service.payment_confirmed(ctx.results['order'], ctx.results['payment'])
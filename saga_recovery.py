@@ -0,0 +1,197 @@
+from saga_db_schema import SagaOrder as SagaOrder_DB, SagaStatus
+from saga_order import SagaOrder
+from sqlalchemy import literal_column, or_, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from uuid import UUID
+from config import settings
+import asyncio
+import deadline
+import logging
+
+
+log = logging.getLogger(__name__)
+
+# Статус литералом, а не параметром: для подготовленного запроса asyncpg Postgres
+# строит generic-план и по $1 не докажет условие частичного индекса
+# ix_order_sagas_unfinished_last_updated (WHERE status = 'UNFINISHED'). Enum хранится по имени
+_UNFINISHED = literal_column(f"'{SagaStatus.UNFINISHED.name}'")
+
+
+async def claim_saga(
+    session_factory: async_sessionmaker,
+    saga_id: UUID,
+    submitted_at: datetime,
+    stale_after: timedelta
+) -> SagaOrder_DB | None:
+    """
+    Забирает одну сагу так же, как разгребатель: FOR UPDATE SKIP LOCKED и сдвиг
+    last_updated как аренда. Сага свободна, пока last_updated равен отметке
+    создания (ее еще никто не трогал) или аренда протухла. Иначе ее уже ведет
+    разгребатель этой или другой реплики - возвращается None.
+    """
+    now = datetime.utcnow()
+    async with session_factory() as db:
+        result = await db.execute(
+            select(SagaOrder_DB)
+            .where(
+                SagaOrder_DB.id == saga_id,
+                SagaOrder_DB.status == SagaStatus.UNFINISHED,
+                or_(
+                    SagaOrder_DB.last_updated == submitted_at,
+                    SagaOrder_DB.last_updated < now - stale_after
+                )
+            )
+            .with_for_update(skip_locked = True)
+        )
+        saga = result.scalar_one_or_none()
+
+        if saga is not None:
+            await db.execute(
+                update(SagaOrder_DB)
+                .where(SagaOrder_DB.id == saga_id)
+                .values(last_updated = now)
+            )
+        await db.commit()
+
+    return saga
+
+
+async def _renew_lease(
+    session_factory: async_sessionmaker,
+    saga_id: UUID,
+    interval: float
+):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with session_factory() as db:
+                await db.execute(
+                    update(SagaOrder_DB)
+                    .where(
+                        SagaOrder_DB.id == saga_id,
+                        SagaOrder_DB.status == SagaStatus.UNFINISHED
+                    )
+                    .values(last_updated = datetime.utcnow())
+                )
+                await db.commit()
+        except Exception:
+            # Следующая попытка через interval; аренда живет stale_after
+            log.warning('Не удалось продлить аренду саги', exc_info = True, extra = {'saga_id': saga_id})
+
+
+@asynccontextmanager
+async def saga_lease(
+    session_factory: async_sessionmaker,
+    saga_id: UUID,
+    stale_after: timedelta
+):
+    # Долгий шаг (повторы, таймауты) не должен дать аренде протухнуть:
+    # продлеваем ее отдельной сессией втрое чаще срока
+    task = asyncio.create_task(_renew_lease(session_factory, saga_id, stale_after.total_seconds() / 3))
+    try:
+        yield
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions = True)
+
+
+class SagaRecoveryWorker:
+    """
+    Разгребатель саг, зависших в UNFINISHED (например, после падения пода).
+
+    Раз в interval секунд забирает пачку саг, не менявшихся дольше stale_after,
+    через FOR UPDATE SKIP LOCKED и сразу сдвигает им last_updated - это аренда:
+    другие реплики не увидят эти саги, пока она не истечет. Потом продолжает или
+    откатывает их не более чем по concurrency одновременно.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        interval: float = 30.0,
+        stale_after: float = 300.0,
+        batch_size: int = 50,
+        concurrency: int = 5
+    ):
+        self._session_factory = session_factory
+        self._interval = interval
+        self._stale_after = timedelta(seconds = stale_after)
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._saga = SagaOrder()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self.run_once()
+            except Exception:
+                log.exception('Ошибка разгребателя саг')
+                claimed = 0
+            # Полная пачка - скорее всего, есть еще, берем следующую сразу
+            if claimed < self._batch_size:
+                await asyncio.sleep(self._interval)
+
+    async def claim_batch(self) -> list:
+        now = datetime.utcnow()
+        async with self._session_factory() as db:
+            result = await db.execute(
+                select(SagaOrder_DB)
+                .where(
+                    SagaOrder_DB.status == _UNFINISHED,
+                    SagaOrder_DB.last_updated < now - self._stale_after
+                )
+                .order_by(SagaOrder_DB.last_updated)
+                .limit(self._batch_size)
+                .with_for_update(skip_locked = True)
+            )
+            sagas = result.scalars().all()
+
+            if sagas:
+                await db.execute(
+                    update(SagaOrder_DB)
+                    .where(SagaOrder_DB.id.in_([saga.id for saga in sagas]))
+                    .values(last_updated = now)
+                )
+            await db.commit()
+
+        return sagas
+
+    async def run_once(self) -> int:
+        sagas = await self.claim_batch()
+        if not sagas:
+            return 0
+
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def recover(saga: SagaOrder_DB):
+            async with semaphore:
+                async with self._session_factory() as db:
+                    try:
+                        # Саги асинхронного режима хранят данные заказа и продолжаются,
+                        # остальные можно только откатить
+                        with deadline.deadline_scope(settings.deadline.saga_timeout):
+                            await self._saga.recover_saga(saga, db)
+                    except Exception:
+                        # Останется UNFINISHED и будет взята снова после истечения аренды
+                        log.exception('Не удалось восстановить сагу', extra = {'saga_id': saga.id})
+
+        await asyncio.gather(*(recover(saga) for saga in sagas))
+
+        return len(sagas)
@@ -0,0 +1,69 @@
+from typing import Awaitable, Callable
+import asyncio
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+class SagaQueueFull(Exception):
+    pass
+
+
+class SagaWorkerPool:
+    """
+    Ограниченный пул воркеров, доводящих сохраненные саги до конца.
+
+    Очередь ограничена queue_size, одновременно выполняется не больше workers
+    саг. Что не успело выполниться к остановке пода, подберет разгребатель.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable],
+        workers: int = 10,
+        queue_size: int = 1000
+    ):
+        self._handler = handler
+        self._workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize = queue_size)
+        self._tasks: list = []
+        self.active = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def has_capacity(self) -> bool:
+        return not self._queue.full()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self._workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions = True)
+        self._tasks = []
+
+    def submit(
+        self,
+        item
+    ):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            raise SagaQueueFull()
+
+    async def _work(self):
+        while True:
+            item = await self._queue.get()
+            self.active += 1
+            try:
+                await self._handler(item)
+            except Exception:
+                log.exception('Ошибка воркера саг')
+            finally:
+                self.active -= 1
+                self._queue.task_done()
@@ -1,49 +1,347 @@
 from config import settings
 from fastapi import HTTPException
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from singleflight import SingleFlight
+from bulkhead import Bulkhead, BulkheadFullError
+from hedging import Hedger, HedgeBudget
+from metrics import DOWNSTREAM_LATENCY, DOWNSTREAM_RESPONSES
+from contextlib import nullcontext
+from models import ID
+from pydantic import TypeAdapter
+from uuid import UUID
+import deadline
+import endpoints
+import asyncio
+import tracing
+import httpx
+import logging
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# Статусы, при которых повтор того же запроса имеет смысл
+TRANSIENT_STATUSES = {429, 502, 503, 504}
+
+
+def is_transient(
+    error: Exception
+) -> bool:
+    # Свои отказы (предохранитель, переборка, срок запроса) не повторяем:
+    # повтор их не исправит, а только задержит откат
+    if isinstance(error, (CircuitOpenError, BulkheadFullError, deadline.DeadlineExceeded)):
+        return False
+    if isinstance(error, HTTPException):
+        return error.status_code in TRANSIENT_STATUSES
+    return isinstance(error, (httpx.TransportError, TimeoutError))
+
 
 class Service:
-    def __init__(self):
-        self._base_url = ""
+    # Имя нижестоящего сервиса, под ним живет общий клиент
+    _name: str = None
+
+    # Общие клиенты на все экземпляры, создаются и закрываются в lifespan приложения
+    _clients: dict = {}
+    _registry: dict = {}
+    _breakers: dict = {}
+    _bulkheads: dict = {}
+    _hedgers: dict = {}
+    # TypeAdapter(list[Model]) строится дорого, поэтому один на модель
+    _list_adapters: dict = {}
+    _flights = SingleFlight()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls._name is not None:
+            Service._registry[cls._name] = cls
+
+    @staticmethod
+    def _new_client():
+        http = settings.http
+        return httpx.AsyncClient(
+            limits = httpx.Limits(
+                max_connections = http.max_connections,
+                max_keepalive_connections = http.max_keepalive_connections,
+                keepalive_expiry = http.keepalive_expiry
+            ),
+            timeout = http.timeout,
+            http2 = http.http2
+        )
+
+    @classmethod
+    def open_clients(cls):
+        for name in Service._registry:
+            if name not in Service._clients:
+                Service._clients[name] = cls._new_client()
+
+    @classmethod
+    async def close_clients(cls):
+        clients = list(Service._clients.values())
+        Service._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+    @classmethod
+    def _get_breaker(
+        cls,
+        name: str
+    ) -> CircuitBreaker:
+        breaker = Service._breakers.get(name)
+        if breaker is None:
+            cb = settings.breaker
+            breaker = CircuitBreaker(
+                name,
+                failure_rate_threshold = cb.failure_rate_threshold,
+                slow_call_rate_threshold = cb.slow_call_rate_threshold,
+                slow_call_duration = cb.slow_call_duration,
+                window_size = cb.window_size,
+                min_calls = cb.min_calls,
+                open_duration = cb.open_duration,
+                half_open_max_calls = cb.half_open_max_calls
+            )
+            Service._breakers[name] = breaker
+        return breaker
+
+    @classmethod
+    def _get_bulkhead(
+        cls,
+        name: str
+    ) -> Bulkhead:
+        bulkhead = Service._bulkheads.get(name)
+        if bulkhead is None:
+            bulkhead = Bulkhead(name, **settings.bulkhead.for_service(name))
+            Service._bulkheads[name] = bulkhead
+        return bulkhead
+
+    @classmethod
+    def _get_hedger(
+        cls,
+        operation: str
+    ) -> Hedger:
+        hedger = Service._hedgers.get(operation)
+        if hedger is None:
+            hs = settings.hedge
+            hedger = Hedger(
+                operation,
+                percentile = hs.percentile,
+                min_delay = hs.min_delay,
+                max_delay = hs.max_delay,
+                window_size = hs.window_size,
+                min_samples = hs.min_samples,
+                budget = HedgeBudget(hs.budget_ratio, hs.budget_burst)
+            )
+            Service._hedgers[operation] = hedger
+        return hedger
+
+    @classmethod
+    def ensure_available(
+        cls,
+        *names: str
+    ):
+        # Дешевая проверка до старта саги: если кто-то из участников разомкнут - сразу отказ
+        if not settings.breaker.enabled:
+            return
+        for name in names:
+            if not cls._get_breaker(name).is_available():
+                raise CircuitOpenError(name)
+
+    @staticmethod
+    def decode(
+        response,
+        model
+    ):
+        # Байты ответа валидируются сразу в модель JSON-парсером pydantic-core,
+        # без промежуточного dict из response.json()
+        return model.model_validate_json(response.content)
+
+    @classmethod
+    def decode_list(
+        cls,
+        response,
+        model
+    ) -> list:
+        adapter = Service._list_adapters.get(model)
+        if adapter is None:
+            adapter = TypeAdapter(list[model])
+            Service._list_adapters[model] = adapter
+        return adapter.validate_json(response.content)
 
-    def _build_base_url(
+    @staticmethod
+    def decode_id(
+        response
+    ) -> UUID:
+        # Шагам саги от ответа нужен только id, остальные поля не разбираются
+        return ID.model_validate_json(response.content).id
+
+    def _url(
+        self,
+        operation: str,
+        param: str | None = None
+    ) -> str:
+        # Адреса собраны заранее в endpoints.registry, здесь - только подстановка параметра
+        return endpoints.registry.get(self._name, operation).url(param)
+
+    @property
+    def _client(self) -> httpx.AsyncClient:
+        client = Service._clients.get(self._name)
+        if client is None or client.is_closed:
+            # Вне lifespan (скрипты, миграции) клиент поднимется лениво
+            client = self._new_client()
+            Service._clients[self._name] = client
+        return client
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        operation: str | None = None,
+        stream: bool = False,
+        **kwargs
+    ):
+        # operation - имя операции из endpoints.registry, метка метрик вызова
+        # stream = True - отдаем ответ сразу после заголовков, тело читает и закрывает вызывающий
+        # Оставшийся бюджет запроса становится таймаутом вызова и уходит вниз заголовком
+        remaining = deadline.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise deadline.DeadlineExceeded()
+            kwargs['timeout'] = min(remaining, settings.http.timeout)
+            headers = dict(kwargs.get('headers') or {})
+            headers[settings.deadline.header] = f'{remaining:.3f}'
+            kwargs['headers'] = headers
+
+        breaker = None
+        if settings.breaker.enabled:
+            breaker = self._get_breaker(self._name)
+            breaker.before_call()
+
+        bulkhead = nullcontext()
+        if settings.bulkhead.enabled:
+            bulkhead = self._get_bulkhead(self._name).acquire(remaining)
+
+        try:
+            async with bulkhead:
+                with tracing.span(f'{self._name}.{operation or "other"}', tracing.SpanKind.CLIENT, attributes = {
+                    'http.method': method,
+                    'http.url': url,
+                }) as current:
+                    # Нижестоящий сервис продолжает трассу шлюза
+                    kwargs['headers'] = tracing.inject(dict(kwargs.get('headers') or {}))
+                    start = time.monotonic()
+                    client = self._client
+                    response = await client.send(client.build_request(method, url, **kwargs), stream = stream)
+                    current.set_attribute('http.status_code', response.status_code)
+                    if response.status_code >= 500:
+                        tracing.set_error(current, f'HTTP {response.status_code}')
+        except httpx.HTTPError as e:
+            duration = time.monotonic() - start
+            DOWNSTREAM_LATENCY.labels(self._name, operation or 'other').observe(duration)
+            DOWNSTREAM_RESPONSES.labels(self._name, operation or 'other', type(e).__name__).inc()
+            # Таймаут, урезанный бюджетом запроса, - это срок клиента (X-Request-Timeout),
+            # а не отказ нижестоящего сервиса. Иначе любой клиент с коротким сроком
+            # разомкнет предохранитель для всех
+            cut_by_deadline = remaining is not None and remaining < settings.http.timeout
+            if isinstance(e, httpx.TimeoutException) and (cut_by_deadline or deadline.expired()):
+                if breaker is not None:
+                    breaker.release()
+                raise deadline.DeadlineExceeded() from e
+            if breaker is not None:
+                breaker.record(False, duration)
+            raise
+        except BaseException:
+            # Вызова вниз не было, его отменили или он упал не на сети (клиент закрыт
+            # при остановке, ошибка сборки запроса) - исхода нет, пробный слот возвращаем.
+            # Иначе утекшие слоты навсегда оставят предохранитель в HALF_OPEN
+            if breaker is not None:
+                breaker.release()
+            raise
+
+        duration = time.monotonic() - start
+        DOWNSTREAM_LATENCY.labels(self._name, operation or 'other').observe(duration)
+        DOWNSTREAM_RESPONSES.labels(self._name, operation or 'other', str(response.status_code)).inc()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('downstream call', extra = {
+                'service': self._name,
+                'method': method,
+                'url': url,
+                'status': response.status_code,
+                'duration': round(duration, 4)
+            })
+        if stream and not response.is_success:
+            # Для текста ошибки тело нужно дочитать, соединение вернуть в пул
+            try:
+                await response.aread()
+            except BaseException:
+                # Статус уже получен - это и есть исход вызова, даже если тело не дочитали
+                if breaker is not None:
+                    breaker.record(response.status_code < 500, duration)
+                raise
+            finally:
+                await response.aclose()
+
+        self._check_response(response, duration)
+
+        return response
+
+    @staticmethod
+    def _idempotency_headers(
+        key: str | None
+    ) -> dict | None:
+        # Ключ позволяет нижестоящему сервису распознать повтор и вернуть прежний результат
+        if key is None:
+            return None
+        return {settings.saga_retry.idempotency_header: key}
+
+    async def _get(
         self,
-        host: str = None,
-        port: str = None,
-        endpoint: str = None,
-        param: str = None
+        url: str,
+        operation: str | None = None,
+        hedge: bool = False
     ):
-        url = "http://"
-        if host is not None:
-            url += host
-        if port is not None:
-            url += ':' + port
-        if endpoint is not None:
-            url += '/' + endpoint
-        if param is not None:
-            url += '/' + param
-        print(url)
-        self._base_url = url
+        # hedge - включить для операции хеджирование: медленный ответ
+        # дублируется вторым запросом, побеждает первый
+        call = lambda: self._request('GET', url, operation)
+        if hedge and settings.hedge.enabled:
+            hedger = self._get_hedger(f'{self._name}.{operation}')
+            call = lambda: hedger.run(lambda: self._request('GET', url, operation))
+
+        # GET идемпотентен, поэтому одновременные одинаковые запросы делят один ответ
+        if not settings.http.single_flight:
+            return await call()
+
+        # Общий вызов не должен жить по сроку того, кто пришел первым: короткий
+        # X-Request-Timeout одного клиента уронил бы 504 всех ждущих. Вызов идет
+        # с обычным settings.http.timeout, а свой срок каждый применяет к ожиданию
+        async def shared():
+            with deadline.no_deadline():
+                return await call()
+
+        remaining = deadline.remaining()
+        if remaining is None:
+            return await Service._flights.do(url, shared)
+        if remaining <= 0:
+            raise deadline.DeadlineExceeded()
+        try:
+            # do() ждет через shield - отмена по сроку не трогает общий вызов
+            return await asyncio.wait_for(Service._flights.do(url, shared), remaining)
+        except TimeoutError:
+            raise deadline.DeadlineExceeded()
 
     def _check_response(
         self,
-        response
+        response,
+        duration: float = 0.0
     ):
+        if settings.breaker.enabled:
+            # 4xx - ошибка клиента, а не нижестоящего сервиса, предохранитель ее не считает
+            self._get_breaker(self._name).record(
+                response.status_code < 500,
+                duration
+            )
         if not response.is_success:
             raise HTTPException(
-                status_code=response.status_code, 
+                status_code=response.status_code,
                 detail=response.text
             )
-        
 
-    def _build_endpoint_url(
-        self,
-        endpoint: str = None,
-        param: str = None
-    ):
-        url = self._base_url
-        if endpoint is not None:
-            url += '/' + endpoint
-        if param is not None:
-            url += '/' + param
-        print(url)
-        return url
\ No newline at end of file
@@ -1,17 +1,11 @@
 
-from config import settings
 from models import AuthCreate
-import httpx
 from fastapi.security import OAuth2PasswordRequestForm
 from service import Service
 
 
 class AuthService(Service):
-    def __init__(self):
-        self._build_base_url(
-            host = settings.auth_url.host,
-            port = settings.auth_url.port 
-        )
+    _name = 'auth'
 
 
     async def create_auth(
@@ -19,20 +13,19 @@ class AuthService(Service):
         username: str,
         password: str
     ):
-        url = self._build_endpoint_url(settings.auth_url.register_endpoint)
+        url = self._url('register')
         
         new_auth = AuthCreate(
             username = username,
             password = password, 
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_auth.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'register',
+            json = new_auth.model_dump()
+        )
 
         return response
 
@@ -41,12 +34,9 @@ class AuthService(Service):
         self,
         username: str
     ):
-        url = self._build_endpoint_url(settings.auth_url.unregister_endpoint, username)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(url)
+        url = self._url('unregister', username)
 
-        self._check_response(response)
+        response = await self._request('DELETE', url, operation = 'unregister')
 
         return response
 
@@ -55,18 +45,17 @@ class AuthService(Service):
         self,
         auth_data: OAuth2PasswordRequestForm
     ):
-        url = self._build_endpoint_url(endpoint = settings.auth_url.login_endpoint)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                data={
-                    "username": auth_data.username,
-                    "password": auth_data.password
-                }
-            )
-
-        self._check_response(response)
+        url = self._url('login')
+
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'login',
+            data={
+                "username": auth_data.username,
+                "password": auth_data.password
+            }
+        )
 
         return response
     
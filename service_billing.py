@@ -1,35 +1,28 @@
-from config import settings
 from models import WalletCreate, TransactionCreate
-import httpx
 from service import Service
 from decimal import Decimal
 from uuid import UUID
 
 class BillingService(Service):
-    def __init__(self):
-        self._build_base_url(
-            host = settings.bill_url.host,
-            port = settings.bill_url.port 
-        )
+    _name = 'billing'
 
 
     async def create_wallet(
         self,
         username: str
     ):
-        url = self._build_endpoint_url(settings.bill_url.register_endpoint)
+        url = self._url('register')
 
         new_wallet = WalletCreate(
             username = username
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_wallet.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'register',
+            json = new_wallet.model_dump()
+        )
 
         return response
 
@@ -46,12 +39,9 @@ class BillingService(Service):
         self,
         username: str
     ):
-        url = self._build_endpoint_url(settings.bill_url.wallet_get_endpoint, username)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        url = self._url('wallet_get', username)
 
-        self._check_response(response)
+        response = await self._get(url, 'wallet_get')
 
         return response
 
@@ -59,22 +49,23 @@ class BillingService(Service):
     async def create_transaction(
         self, 
         username: str,
-        amount: Decimal
+        amount: Decimal,
+        idempotency_key: str | None = None
     ):
-        url = self._build_endpoint_url(settings.bill_url.transaction_endpoint)
+        url = self._url('transaction')
 
         new_transaction = TransactionCreate(
             username = username,
             amount = str(amount)
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_transaction.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'transaction',
+            json = new_transaction.model_dump(),
+            headers = self._idempotency_headers(idempotency_key)
+        )
 
         return response
     
@@ -83,11 +74,8 @@ class BillingService(Service):
         self,
         transaction_id: UUID
     ):
-        url = self._build_endpoint_url(settings.bill_url.storno_endpoint, str(transaction_id))
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url)
+        url = self._url('storno', str(transaction_id))
 
-        self._check_response(response)
+        response = await self._request('POST', url, operation = 'storno')
 
         return response
\ No newline at end of file
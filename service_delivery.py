@@ -1,31 +1,24 @@
-from config import settings
 from models import CourierCreate, DeliveryCreate
 from service import Service
-import httpx
 from uuid import UUID
 
 
 class DeliveryService(Service):
-    def __init__(self):
-        self._build_base_url(
-            host = settings.deliv_url.host,
-            port = settings.deliv_url.port 
-        )
+    _name = 'delivery'
 
 
     async def create_courier(
         self,
         new_courier: CourierCreate
     ):
-        url = self._build_endpoint_url(settings.deliv_url.courier_create_endpoint)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_courier.model_dump()
-            )
+        url = self._url('courier_create')
 
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'courier_create',
+            json = new_courier.model_dump()
+        )
 
         return response
     
@@ -33,22 +26,23 @@ class DeliveryService(Service):
     async def create_delivery(
         self,
         order_id: UUID,
-        address: str
+        address: str,
+        idempotency_key: str | None = None
     ):
-        url = self._build_endpoint_url(settings.deliv_url.delivery_create_endpoint)
+        url = self._url('delivery_create')
 
         new_delivery = DeliveryCreate(
             order_id = str(order_id),
             address = address 
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_delivery.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'delivery_create',
+            json = new_delivery.model_dump(mode = 'json'),
+            headers = self._idempotency_headers(idempotency_key)
+        )
 
         return response
     
@@ -57,12 +51,9 @@ class DeliveryService(Service):
         self,
         order_id: UUID
     ):
-        url = self._build_endpoint_url(settings.deliv_url.delivery_cancel_endpoint, str(order_id))
-
-        async with httpx.AsyncClient() as client:
-            response = await client.put(url)
+        url = self._url('delivery_cancel', str(order_id))
 
-        self._check_response(response)
+        response = await self._request('PUT', url, operation = 'delivery_cancel')
 
         return response
     
@@ -71,11 +62,8 @@ class DeliveryService(Service):
         self,
         order_id: UUID
     ):
-        url = self._build_endpoint_url(settings.deliv_url.delivery_get_endpoint, str(order_id))
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        url = self._url('delivery_get', str(order_id))
 
-        self._check_response(response)
+        response = await self._get(url, 'delivery_get')
 
         return response
\ No newline at end of file
@@ -1,37 +1,32 @@
-from config import settings
 from models import OrderCreateOrderService, OrderUpdateEvent
-import httpx
 from decimal import Decimal
 from uuid import UUID
 from service import Service
 
 class OrderService(Service):
-    def __init__(self):
-        self._build_base_url(
-            host = settings.order_url.host,
-            port = settings.order_url.port 
-        )
+    _name = 'order'
 
     
     async def create_order(
         self,
         username: str,
-        price: Decimal
+        price: Decimal,
+        idempotency_key: str | None = None
     ):
-        url = self._build_endpoint_url(settings.order_url.create_endpoint)
+        url = self._url('create')
 
         new_order = OrderCreateOrderService(
             username = username,
             price    = str(price)
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_order.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'create',
+            json = new_order.model_dump(),
+            headers = self._idempotency_headers(idempotency_key)
+        )
 
         return response
     
@@ -40,15 +35,14 @@ class OrderService(Service):
         self,
         event: OrderUpdateEvent
     ):
-        url = self._build_endpoint_url(settings.order_url.event_endpoint)        
+        url = self._url('event')        
 
-        async with httpx.AsyncClient() as client:
-            response = await client.put(
-                url,
-                json = event.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'PUT',
+            url,
+            operation = 'event',
+            json = event.model_dump()
+        )
 
         return response
 
@@ -74,7 +68,7 @@ class OrderService(Service):
         order_id: UUID
     ):
         failure_event = OrderUpdateEvent(
-            id    = order_id,
+            id    = str(order_id),
             event = 'payment_failed'
         )
 
@@ -87,12 +81,9 @@ class OrderService(Service):
         self,
         order_id: UUID
     ):
-        url = self._build_endpoint_url(settings.order_url.get_by_id_endpoint, str(order_id))
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        url = self._url('get_by_id', str(order_id))
 
-        self._check_response(response)
+        response = await self._get(url, 'get_by_id', hedge = True)
 
         return response
     
@@ -101,11 +92,37 @@ class OrderService(Service):
         self,
         req_uname: str
     ):
-        url = self._build_endpoint_url(settings.order_url.get_by_user_endpoint, req_uname)
+        url = self._url('get_by_user', req_uname)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        response = await self._get(url, 'get_by_user')
 
-        self._check_response(response)
+        return response
+
+
+    async def stream_orders_by_uname(
+        self,
+        req_uname: str,
+        limit: int | None = None,
+        offset: int | None = None,
+        accept_encoding: str = 'identity'
+    ):
+        url = self._url('get_by_user', req_uname)
+
+        params = {}
+        if limit is not None:
+            params['limit'] = limit
+        if offset is not None:
+            params['offset'] = offset
+
+        # Тело не читается: его по кускам отдает шлюз, а закрывает вызывающий
+        # Без явного Accept-Encoding httpx попросит gzip сам - а распаковывать тут некому
+        response = await self._request(
+            'GET',
+            url,
+            operation = 'get_by_user',
+            stream = True,
+            params = params,
+            headers = {'Accept-Encoding': accept_encoding}
+        )
 
         return response
\ No newline at end of file
@@ -1,14 +1,8 @@
-from config import settings
 from models import ProfileCreate, ProfileUpdate
 from service import Service
-import httpx
 
 class ProfileService(Service):
-    def __init__(self):
-        self._build_base_url(
-            host = settings.prof_url.host,
-            port = settings.prof_url.port 
-        )
+    _name = 'profile'
 
     
     async def create_profile(
@@ -19,7 +13,7 @@ class ProfileService(Service):
         email: str,
         phone: str
     ):
-        url = self._build_endpoint_url(settings.prof_url.register_endpoint)
+        url = self._url('register')
 
         new_profile = ProfileCreate(
             username = username,
@@ -29,13 +23,12 @@ class ProfileService(Service):
             phone = phone
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_profile.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'register',
+            json = new_profile.model_dump()
+        )
 
         return response
 
@@ -44,12 +37,9 @@ class ProfileService(Service):
         self,
         username: str
     ):
-        url = self._build_endpoint_url(settings.prof_url.del_endpoint, username)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(url)
+        url = self._url('del', username)
 
-        self._check_response(response)
+        response = await self._request('DELETE', url, operation = 'del')
 
         return response
     
@@ -58,12 +48,9 @@ class ProfileService(Service):
         self,
         username: str
     ):
-        url = self._build_endpoint_url(settings.prof_url.get_endpoint, username)
+        url = self._url('get', username)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-
-        self._check_response(response)
+        response = await self._get(url, 'get')
 
         return response
 
@@ -73,15 +60,14 @@ class ProfileService(Service):
         username: str,
         profile_upd: ProfileUpdate
     ):
-        url = self._build_endpoint_url(settings.prof_url.upd_endpoint, username)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.put(
-                url,
-                json = profile_upd.model_dump()
-            )
+        url = self._url('upd', username)
 
-        self._check_response(response)
+        response = await self._request(
+            'PUT',
+            url,
+            operation = 'upd',
+            json = profile_upd.model_dump()
+        )
 
         return response 
 
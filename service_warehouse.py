@@ -1,30 +1,23 @@
-from config import settings
 from models import GoodCreate, ReservationCreate, StockCreate, ReservationPosCreate
 from service import Service
-import httpx
 from uuid import UUID
 
 class WarehouseService(Service):
-    def __init__(self):
-        self._build_base_url(
-            host = settings.wareh_url.host,
-            port = settings.wareh_url.port 
-        )
+    _name = 'warehouse'
 
     
     async def create_good(
         self, 
         new_good: GoodCreate,
     ):
-        url = self._build_endpoint_url(settings.wareh_url.good_create_endpoint)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_good.model_dump()
-            )
+        url = self._url('good_create')
 
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'good_create',
+            json = new_good.model_dump()
+        )
 
         return response
     
@@ -33,15 +26,14 @@ class WarehouseService(Service):
         self,
         new_stock: StockCreate
     ):
-        url = self._build_endpoint_url(settings.wareh_url.stock_create_endpoint)
-
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_stock.model_dump()
-            )
+        url = self._url('stock_create')
 
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'stock_create',
+            json = new_stock.model_dump()
+        )
 
         return response
     
@@ -49,9 +41,10 @@ class WarehouseService(Service):
     async def create_reservation(
         self,
         order_id: UUID,
-        order_positions
+        order_positions,
+        idempotency_key: str | None = None
     ):
-        url = self._build_endpoint_url(settings.wareh_url.reserve_create_endpoint)
+        url = self._url('reserve_create')
 
         reservation_positions = []
 
@@ -68,13 +61,13 @@ class WarehouseService(Service):
             positions = reservation_positions 
         )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json = new_reservation.model_dump()
-            )
-
-        self._check_response(response)
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'reserve_create',
+            json = new_reservation.model_dump(),
+            headers = self._idempotency_headers(idempotency_key)
+        )
 
         return response
 
@@ -83,12 +76,9 @@ class WarehouseService(Service):
         self,
         order_id: UUID
     ):
-        url = self._build_endpoint_url(settings.wareh_url.reserve_cancel_endpoint, str(order_id))
+        url = self._url('reserve_cancel', str(order_id))
 
-        async with httpx.AsyncClient() as client:
-            response = await client.put(url)
-
-        self._check_response(response)
+        response = await self._request('PUT', url, operation = 'reserve_cancel')
 
         return response
     
@@ -97,12 +87,9 @@ class WarehouseService(Service):
         self,
         order_id: UUID
     ):
-        url = self._build_endpoint_url(settings.wareh_url.reserve_get_endpoint, str(order_id))
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
+        url = self._url('reserve_get', str(order_id))
 
-        self._check_response(response)
+        response = await self._get(url, 'reserve_get')
 
         return response
     
@@ -111,12 +98,25 @@ class WarehouseService(Service):
         self,
         good_id: UUID
     ):
-        url = self._build_endpoint_url(settings.wareh_url.stock_get_endpoint, str(good_id))
+        url = self._url('stock_get', str(good_id))
+
+        response = await self._get(url, 'stock_get', hedge = True)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
 
-        self._check_response(response)
+        return response
+
 
+    async def get_stocks_by_good_ids(
+        self,
+        good_ids: list
+    ):
+        url = self._url('stock_batch')
+
+        response = await self._request(
+            'POST',
+            url,
+            operation = 'stock_batch',
+            json = {'good_ids': [str(good_id) for good_id in good_ids]}
+        )
 
         return response
\ No newline at end of file
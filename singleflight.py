@@ -0,0 +1,42 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Склейка одинаковых одновременных вызовов.
+
+    Пока вызов с ключом key в полете, все остальные вызовы с тем же ключом
+    ждут его и получают тот же результат (или то же исключение).
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _forget(
+        self,
+        key,
+        future: asyncio.Future
+    ):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        # Исключение забираем, чтобы asyncio не ругался, если ждать было уже некому
+        if not future.cancelled():
+            future.exception()
+
+    async def do(
+        self,
+        key,
+        func
+    ):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+
+        # Отмена одного из ждущих не должна отменять общий вызов для остальных
+        return await asyncio.shield(future)
@@ -0,0 +1,156 @@
+from opentelemetry import trace, propagate
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from contextlib import contextmanager
+from config import settings
+import threading
+
+
+# Пока setup() не поставил провайдер (TRACING_EXPORTER=none), спаны - no-op
+tracer = trace.get_tracer('api-gateway')
+
+_provider = None
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Экспортер в файл: по JSON-строке на спан. Нужен, чтобы проверять трассы
+    без коллектора.
+    """
+
+    def __init__(
+        self,
+        path: str
+    ):
+        self._file = open(path, 'a', encoding = 'utf-8')
+        self._lock = threading.Lock()
+
+    def export(
+        self,
+        spans
+    ):
+        with self._lock:
+            for span in spans:
+                self._file.write(span.to_json(indent = None) + '\n')
+            self._file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+    def force_flush(
+        self,
+        timeout_millis: int = 30000
+    ) -> bool:
+        with self._lock:
+            self._file.flush()
+        return True
+
+
+def _build_exporter(
+    name: str
+):
+    if name == 'console':
+        return ConsoleSpanExporter()
+    if name == 'file':
+        return FileSpanExporter(settings.tracing.file_path)
+    if name == 'otlp':
+        # Пакет экспортера нужен только тем, кто его выбрал
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint = settings.tracing.otlp_endpoint)
+    raise ValueError(f'Unknown tracing exporter: {name}')
+
+
+def setup():
+    global _provider
+    exporter_name = settings.tracing.exporter.strip().lower()
+    if _provider is not None or exporter_name in ('', 'none'):
+        return
+
+    _provider = TracerProvider(
+        resource = Resource.create({'service.name': settings.tracing.service_name}),
+        sampler = ParentBased(TraceIdRatioBased(settings.tracing.sample_ratio))
+    )
+    # Отправка идет пачками в фоновом потоке, запрос на экспорт не ждет
+    _provider.add_span_processor(BatchSpanProcessor(_build_exporter(exporter_name)))
+    trace.set_tracer_provider(_provider)
+
+
+def shutdown():
+    global _provider
+    if _provider is None:
+        return
+    # Дописываем накопленные спаны
+    _provider.shutdown()
+    _provider = None
+
+
+def inject(
+    headers: dict
+) -> dict:
+    # W3C traceparent (и tracestate) текущего спана - в заголовки вызова вниз
+    propagate.inject(headers)
+    return headers
+
+
+def extract(
+    headers
+):
+    return propagate.extract(headers)
+
+
+@contextmanager
+def span(
+    name: str,
+    kind: SpanKind = SpanKind.INTERNAL,
+    context = None,
+    attributes: dict | None = None
+):
+    # Исключение помечает спан ошибкой и летит дальше
+    with tracer.start_as_current_span(
+        name,
+        context = context,
+        kind = kind,
+        attributes = {
+            key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in (attributes or {}).items()
+            if value is not None
+        },
+        record_exception = True,
+        set_status_on_exception = True
+    ) as current:
+        yield current
+
+
+@contextmanager
+def server_span(
+    name: str,
+    headers,
+    attributes: dict | None = None
+):
+    # Свежие FastAPI/Starlette при установленном провайдере сами открывают серверный
+    # спан снаружи middleware - тогда дополняем его, а не плодим второй
+    current = trace.get_current_span()
+    if current.is_recording():
+        for key, value in (attributes or {}).items():
+            current.set_attribute(key, value)
+        yield current
+        return
+    # Родитель берется из traceparent клиента, если он его прислал
+    with span(name, SpanKind.SERVER, extract(headers), attributes) as current:
+        yield current
+
+
+def set_error(
+    current,
+    description: str,
+    error: BaseException | None = None
+):
+    # Для ошибок, которые не вылетают из спана, а возвращаются или глотаются
+    if error is not None:
+        current.record_exception(error)
+    current.set_status(Status(StatusCode.ERROR, description))
@@ -3,7 +3,7 @@ from fastapi import Depends, HTTPException, status
 from jwt.exceptions import InvalidTokenError
 from sqlalchemy.ext.asyncio import AsyncSession
 from config import settings
-import jwt
+from jwt_verifier import JWTVerifier
 from models import (
     UserCreate,
     ProfileReturn,
@@ -21,8 +21,14 @@ from models import (
     CourierCreate,
     CourierReturn,
     DeliveryReturn,
-    ReservationReturn
+    ReservationReturn,
+    SagaReturn,
+    SagaAcceptedReturn,
+    SagaExportRow,
+    OrderDetailsReturn,
+    StockLookupReturn
 )
+from service import Service
 from service_auth import AuthService
 from service_profile import ProfileService
 from service_billing import BillingService
@@ -32,16 +38,64 @@ from service_delivery import DeliveryService
 from service_notification import NotificationService
 from saga import SagaRegister
 from saga_order import SagaOrder
-from saga_db_schema import SagaOrder as SagaOrderDB
+from saga_db_schema import SagaOrder as SagaOrderDB, SagaStatus
+from saga_worker import SagaWorkerPool, SagaQueueFull
+from saga_recovery import claim_saga, saga_lease
+from db import AsyncSessionLocal
+from pagination import encode_cursor, decode_cursor, naive_utc
+from datetime import datetime, timedelta
+import deadline
+import endpoints
+import asyncio
+from cache import TTLCache
 from uuid import UUID
 from typing import List
-from sqlalchemy import select, and_, func
+from sqlalchemy import select, and_, func, tuple_
 from sqlalchemy.future import select
 
 
 http_bearer = HTTPBearer()
 
 
+def _model_size(
+    model
+) -> int:
+    return len(model.model_dump_json())
+
+
+# Профили и кошельки меняются только через этот же шлюз (кроме отката саг),
+# поэтому читаем из кэша, а на изменениях пишем/сбрасываем его сами
+profile_cache = TTLCache(
+    'profile',
+    max_entries = settings.cache.profile_max_entries,
+    ttl = settings.cache.profile_ttl,
+    max_bytes = settings.cache.max_bytes,
+    sizeof = _model_size
+)
+
+wallet_cache = TTLCache(
+    'wallet',
+    max_entries = settings.cache.wallet_max_entries,
+    ttl = settings.cache.wallet_ttl,
+    max_bytes = settings.cache.max_bytes,
+    sizeof = _model_size
+)
+
+
+# Сервисы и саги не хранят состояния запроса: по одному экземпляру на приложение,
+# HTTP-клиенты у них и так общие
+auth_service = AuthService()
+profile_service = ProfileService()
+billing_service = BillingService()
+order_service = OrderService()
+notif_service = NotificationService()
+warehouse_service = WarehouseService()
+delivery_service = DeliveryService()
+
+register_saga = SagaRegister()
+order_saga = SagaOrder()
+
+
 def check_response(
     response
 ):
@@ -66,30 +120,25 @@ def check_token_uname(
 def profile_from_response(
     response
 ):
-    json = response.json()    
-    return ProfileReturn(
-        username  = json.get("username"),
-        email     = json.get("email"),
-        phone     = json.get("phone"),
-        firstName = json.get("firstName"),
-        lastName  = json.get("lastName")
-    )
+    return Service.decode(response, ProfileReturn)
+
+
+jwt_verifier = JWTVerifier(
+    settings.auth_jwt.public_key_path.read_text(),
+    settings.auth_jwt.algorithm,
+    cache_max_entries = settings.auth_jwt.cache_max_entries,
+    cache_max_ttl = settings.auth_jwt.cache_max_ttl
+)
 
 
 def decode_jwt(
-    token: str | bytes,
-    public_key: str = settings.auth_jwt.public_key_path.read_text(),
-    algorithm: str = settings.auth_jwt.algorithm,
+    token: str | bytes
 ) -> dict:
-    decoded = jwt.decode(
-        token,
-        public_key,
-        algorithms=[algorithm]
-    )
-    return decoded
+    return jwt_verifier.verify(token)
 
 
-def get_current_token_payload(
+# async, чтобы FastAPI не гонял проверку токена через threadpool
+async def get_current_token_payload(
     credentials: HTTPAuthorizationCredentials = Depends(http_bearer),
 ) -> dict:
     token = credentials.credentials
@@ -109,8 +158,6 @@ def get_current_token_payload(
 async def process_login(
     auth_data: OAuth2PasswordRequestForm
 ):
-    auth_service = AuthService()
-
     response = await auth_service.login(auth_data)
 
     return response.json()
@@ -123,11 +170,17 @@ async def get_profile(
     # Если не совпадет - изнутри шибанет исключением 
     check_token_uname(req_uname, token_payload)
 
-    profile_service = ProfileService()
+    profile = profile_cache.get(req_uname)
+    if profile is not None:
+        return profile
 
     response = await profile_service.get_profile(req_uname)
 
-    return profile_from_response(response)
+    profile = profile_from_response(response)
+
+    profile_cache.set(req_uname, profile)
+
+    return profile
 
 
 async def update_profile(
@@ -138,20 +191,22 @@ async def update_profile(
     # Если не совпадет - изнутри шибанет исключением 
     check_token_uname(req_uname, token_payload)
 
-    profile_service = ProfileService()
-
     response = await profile_service.upd_profile(req_uname, profile_upd)
-    
-    return profile_from_response(response)
+
+    profile = profile_from_response(response)
+
+    profile_cache.set(req_uname, profile)
+
+    return profile
 
 
 async def process_register(
     reg_data: UserCreate
 ):
-    saga = SagaRegister()
-
     # Сага сама выкинет исключения при возникновении
-    result = await saga.execute_saga(reg_data)
+    result = await register_saga.execute_saga(reg_data)
+
+    profile_cache.set(result.username, result)
 
     return result
 
@@ -163,16 +218,17 @@ async def get_wallet(
     # Если не совпадет - изнутри шибанет исключением 
     check_token_uname(req_uname, token_payload)
 
-    billing_service = BillingService()
+    wallet = wallet_cache.get(req_uname)
+    if wallet is not None:
+        return wallet
 
     response = await billing_service.get_wallet(req_uname)
 
-    json = response.json()
+    wallet = Service.decode(response, WalletReturn)
 
-    return WalletReturn(
-        username = json.get("username"),
-        amount = json.get("amount")
-    )
+    wallet_cache.set(req_uname, wallet)
+
+    return wallet
 
 
 async def create_transaction(
@@ -182,17 +238,13 @@ async def create_transaction(
     # Если не совпадет - изнутри шибанет исключением 
     check_token_uname(tr_data.username, token_payload)
 
-    billing_service = BillingService()
-    
-    response = await billing_service.create_transaction(tr_data.username, tr_data.amount)
-
-    json = response.json()
+    try:
+        response = await billing_service.create_transaction(tr_data.username, tr_data.amount)
+    finally:
+        # Сбрасываем и при ошибке: транзакция могла пройти, а ответ потеряться
+        wallet_cache.invalidate(tr_data.username)
 
-    return TransactionReturn(
-        username = json.get("username"),
-        amount   = json.get("amount"),
-        id       = json.get("id")
-    )
+    return Service.decode(response, TransactionReturn)
 
 
 async def process_new_order(
@@ -203,32 +255,89 @@ async def process_new_order(
     # Если не совпадет - изнутри шибанет исключением 
     check_token_uname(order_data.username, token_payload)
 
-    saga = SagaOrder()
+    try:
+        result = await order_saga.execute_saga(order_data, db)
+    finally:
+        # Сага списывает деньги (и сторнирует при откате) - баланс в кэше устарел
+        wallet_cache.invalidate(order_data.username)
+
+    return result
+
+
+async def _run_submitted_order(
+    item: tuple
+):
+    saga_id, submitted_at = item
+    stale_after = timedelta(seconds = settings.recovery.stale_after)
 
-    result = await saga.execute_saga(order_data, db)
+    # Пока сага ждала в очереди, ее мог забрать разгребатель - тогда она не наша
+    saga_row = await claim_saga(AsyncSessionLocal, saga_id, submitted_at, stale_after)
+    if saga_row is None:
+        return None
+
+    username = (saga_row.payload or {}).get('username')
+
+    async with AsyncSessionLocal() as db, saga_lease(AsyncSessionLocal, saga_id, stale_after):
+        try:
+            with deadline.deadline_scope(settings.deadline.saga_timeout):
+                result = await order_saga.recover_saga(saga_row, db)
+        finally:
+            # Сага списывает деньги (и сторнирует при откате) - баланс в кэше устарел
+            wallet_cache.invalidate(username)
 
     return result
 
 
-async def get_order_by_id(
-    order_id: UUID,
-    token_payload: dict
+saga_pool = SagaWorkerPool(
+    _run_submitted_order,
+    workers = settings.saga_workers.workers,
+    queue_size = settings.saga_workers.queue_size
+)
+
+
+async def submit_new_order(
+    order_data: OrderCreate,
+    token_payload: dict,
+    db: AsyncSession
 ):
-    order_service = OrderService()
+    # Если не совпадет - изнутри шибанет исключением 
+    check_token_uname(order_data.username, token_payload)
 
-    response = await order_service.get_order_by_id(order_id)
+    if not saga_pool.has_capacity():
+        raise HTTPException(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail = 'Too many orders in progress'
+        )
 
-    json = response.json()
+    saga_row = await order_saga.submit_saga(order_data, db)
+    saga_id = saga_row.id
 
-    order = OrderReturn(
-        id = UUID(json.get('id')),
-        username = json.get('username'),
-        status = json.get('status'),
-        price = json.get('price'),
-        placed_at = json.get('placed_at'),
-        updated_at = json.get('updated_at')
+    try:
+        saga_pool.submit((saga_id, saga_row.last_updated))
+    except SagaQueueFull:
+        # Намерение уже сохранено - сагу продолжит разгребатель
+        pass
+
+    return SagaAcceptedReturn(
+        saga_id = saga_id,
+        status = SagaStatus.UNFINISHED.value
     )
 
+
+async def fetch_order(
+    order_id: UUID
+):
+    response = await order_service.get_order_by_id(order_id)
+
+    return Service.decode(response, OrderReturn)
+
+
+async def get_order_by_id(
+    order_id: UUID,
+    token_payload: dict
+):
+    order = await fetch_order(order_id)
+
     check_token_uname(order.username, token_payload)
 
     return order
@@ -240,84 +349,251 @@ async def get_orders_by_uname(
 ):
     check_token_uname(req_uname, token_payload)
 
-    order_service = OrderService()
-
     response = await order_service.get_orders_by_uname(req_uname)
 
-    data_list = response.json()
-
-    orders: List[OrderReturn] = [OrderReturn.model_validate(item) for item in data_list]
+    orders: List[OrderReturn] = Service.decode_list(response, OrderReturn)
 
     return orders
 
 
+async def stream_orders_by_uname(
+    req_uname: str,
+    token_payload: dict,
+    limit: int | None = None,
+    offset: int | None = None,
+    accept_encoding: str | None = None
+):
+    check_token_uname(req_uname, token_payload)
+
+    # Тело уходит клиенту сжатым так, как его сжал сервис заказов, поэтому
+    # сжатие допускаем только то, которое принимает сам клиент
+    response = await order_service.stream_orders_by_uname(req_uname, limit, offset, accept_encoding or 'identity')
+
+    # Байты сервиса заказов уходят клиенту как есть, без разбора и повторной сериализации
+    async def body():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+
+    headers = {}
+    if 'content-encoding' in response.headers:
+        # aiter_raw не распаковывает тело, поэтому сжатие передаем клиенту
+        headers['Content-Encoding'] = response.headers['content-encoding']
+        headers['Vary'] = 'Accept-Encoding'
+
+    return body(), response.headers.get('content-type', 'application/json'), headers
+
+
+async def fetch_notifications(
+    order_id: UUID
+):
+    response = await notif_service.get_notifications_for_order_id(order_id)
+
+    notifications: List[NotificationReturn] = Service.decode_list(response, NotificationReturn)
+
+    return notifications
+
+
+async def _details_part(
+    coro
+):
+    # Часть страницы заказа не роняет остальные: исключение возвращается, а не бросается
+    try:
+        return await coro
+    except Exception as e:
+        return e
+
+
 async def get_notifications_for_order(
     order_id: UUID,
     token_payload: dict
 ):
-    order = await get_order_by_id(order_id, token_payload)
-
-    notif_service = NotificationService()
+    # Заказ (для проверки владельца) и уведомления запрашиваем одновременно,
+    # чужие уведомления просто не отдаем
+    async with asyncio.TaskGroup() as tg:
+        order_task = tg.create_task(_details_part(fetch_order(order_id)))
+        notifications_task = tg.create_task(_details_part(fetch_notifications(order_id)))
 
-    response = await notif_service.get_notifications_for_order_id(order_id)
+    order = order_task.result()
+    if isinstance(order, Exception):
+        raise order
 
-    data_list = response.json()
+    # Владелец проверяется раньше ошибки уведомлений: чужой заказ - всегда 403
+    check_token_uname(order.username, token_payload)
 
-    notifications: List[NotificationReturn] = [NotificationReturn.model_validate(item) for item in data_list]
+    notifications = notifications_task.result()
+    if isinstance(notifications, Exception):
+        raise notifications
 
     return notifications
 
 
+async def get_saga_by_order_id(
+    order_id: UUID,
+    db: AsyncSession
+):
+    # Последняя сага заказа (индекс ix_order_sagas_order_id)
+    result = await db.execute(
+        select(SagaOrderDB)
+        .filter(SagaOrderDB.order_id == order_id)
+        .order_by(SagaOrderDB.last_updated.desc())
+        .limit(1)
+    )
+
+    saga = result.scalar_one_or_none()
+
+    return None if saga is None else SagaReturn.model_validate(saga, from_attributes = True)
+
+
+async def get_order_details(
+    order_id: UUID,
+    token_payload: dict,
+    db: AsyncSession
+):
+    parts = {
+        'notifications': fetch_notifications(order_id),
+        'delivery': delivery_get_by_order_id(order_id),
+        'reservation': reservation_get_by_order_id(order_id),
+        'saga': get_saga_by_order_id(order_id, db),
+    }
+
+    denied = None
+
+    async with asyncio.TaskGroup() as tg:
+        order_task = tg.create_task(_details_part(fetch_order(order_id)))
+        tasks = {name: tg.create_task(_details_part(coro)) for name, coro in parts.items()}
+
+        # Без заказа страницы нет: его ошибка (и чужой заказ) отменяет остальные запросы.
+        # Бросать прямо здесь нельзя - TaskGroup завернет исключение в ExceptionGroup
+        order = await order_task
+        if isinstance(order, Exception):
+            denied = order
+        else:
+            try:
+                check_token_uname(order.username, token_payload)
+            except HTTPException as e:
+                denied = e
+        if denied is not None:
+            for task in tasks.values():
+                task.cancel()
+
+    if denied is not None:
+        raise denied
+
+    details = OrderDetailsReturn(order = order)
+
+    for name, task in tasks.items():
+        result = task.result()
+        if isinstance(result, HTTPException) and result.status_code == status.HTTP_404_NOT_FOUND:
+            # Доставки или резерва у заказа еще может не быть - это не ошибка
+            continue
+        if isinstance(result, Exception):
+            details.errors[name] = str(result) or type(result).__name__
+            continue
+        setattr(details, name, result)
+
+    return details
+
+
 async def good_create(
     good_data: GoodCreate
 ):
-    warehouse_service = WarehouseService()
-
     response = await warehouse_service.create_good(good_data)
 
-    json = response.json()
-
-    return GoodReturn.model_validate(json)
+    return Service.decode(response, GoodReturn)
 
 
 async def stock_add(
     stock_data: StockCreate
 ):
-    warehouse_service = WarehouseService()
-
     response = await warehouse_service.add_stock(stock_data)
 
-    json = response.json()
-
-    return StockReturn.model_validate(json)
+    return Service.decode(response, StockReturn)
 
 
 async def courier_create(
     courier_data: CourierCreate
 ):
-    delivery_service = DeliveryService()
-
     response = await delivery_service.create_courier(courier_data)
 
-    json = response.json()
+    return Service.decode(response, CourierReturn)
 
-    return CourierReturn.model_validate(json)
+
+def sagas_query(
+    cursor: str | None = None,
+    saga_status: SagaStatus | None = None,
+    updated_from: datetime | None = None,
+    updated_to: datetime | None = None,
+    order_id: UUID | None = None
+):
+    # Keyset вместо OFFSET: страница стоит O(limit) на любой глубине
+    query = select(SagaOrderDB).order_by(SagaOrderDB.last_updated, SagaOrderDB.id)
+
+    if cursor is not None:
+        last_updated, saga_id = decode_cursor(cursor)
+        query = query.where(tuple_(SagaOrderDB.last_updated, SagaOrderDB.id) > tuple_(last_updated, saga_id))
+    if saga_status is not None:
+        query = query.where(SagaOrderDB.status == saga_status)
+    updated_from = naive_utc(updated_from)
+    updated_to = naive_utc(updated_to)
+    if updated_from is not None:
+        query = query.where(SagaOrderDB.last_updated >= updated_from)
+    if updated_to is not None:
+        query = query.where(SagaOrderDB.last_updated < updated_to)
+    if order_id is not None:
+        query = query.where(SagaOrderDB.order_id == order_id)
+
+    return query
 
 
 async def get_all_order_sagas(
-    db: AsyncSession, 
-    skip: int = 0, 
-    limit: int = 10,
+    db: AsyncSession,
+    limit: int = settings.saga_list.page_size,
+    cursor: str | None = None,
+    saga_status: SagaStatus | None = None,
+    updated_from: datetime | None = None,
+    updated_to: datetime | None = None,
+    order_id: UUID | None = None
 ):
-    result = await db.execute(
-        select(SagaOrderDB)
-        .offset(skip)
-        .limit(limit)
-    )
+    query = sagas_query(cursor, saga_status, updated_from, updated_to, order_id)
+
+    result = await db.execute(query.limit(limit))
 
     sagas = result.scalars().all()
 
-    return sagas
+    # Неполная страница - дальше ничего нет
+    next_cursor = None
+    if len(sagas) == limit:
+        next_cursor = encode_cursor(sagas[-1].last_updated, sagas[-1].id)
+
+    return sagas, next_cursor
+
+
+def export_order_sagas(
+    cursor: str | None = None,
+    saga_status: SagaStatus | None = None,
+    updated_from: datetime | None = None,
+    updated_to: datetime | None = None,
+    order_id: UUID | None = None
+):
+    # Запрос строим сразу, чтобы битый курсор дал 400 до начала стрима
+    query = sagas_query(cursor, saga_status, updated_from, updated_to, order_id)
+    query = query.execution_options(yield_per = settings.saga_list.export_batch_size)
+
+    async def rows():
+        # Своя сессия: зависимость _get_db закрывается раньше, чем уйдет тело ответа
+        async with AsyncSessionLocal() as db:
+            result = await db.stream_scalars(query)
+            async for saga in result:
+                row = SagaExportRow(
+                    cursor = encode_cursor(saga.last_updated, saga.id),
+                    **{field: getattr(saga, field) for field in SagaReturn.model_fields}
+                )
+                yield row.model_dump_json().encode() + b'\n'
+
+    return rows()
 
 
 async def get_saga_by_id(
@@ -343,34 +619,80 @@ async def get_saga_by_id(
 async def stock_get_by_good_id(
     good_id: UUID
 ):
-    warehouse_service = WarehouseService()
-
     response = await warehouse_service.get_stock_by_good_id(good_id)
 
-    json = response.json()
+    return Service.decode(response, StockReturn)
 
-    return StockReturn.model_validate(json)
+
+async def stocks_lookup(
+    good_ids: List[UUID]
+):
+    # Повторы в корзине - один запрос на товар, порядок первого вхождения сохраняется
+    good_ids = list(dict.fromkeys(good_ids))
+
+    if len(good_ids) > settings.stock_lookup.max_ids:
+        raise HTTPException(
+            status_code = status.HTTP_400_BAD_REQUEST,
+            detail = f'Too many goods, max {settings.stock_lookup.max_ids}'
+        )
+
+    result = StockLookupReturn()
+
+    if endpoints.registry.has('warehouse', 'stock_batch'):
+        # Склад умеет отдавать остатки пачкой - один запрос вместо N
+        try:
+            response = await warehouse_service.get_stocks_by_good_ids(good_ids)
+            stocks = Service.decode_list(response, StockReturn)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            result.errors = {good_id: error for good_id in good_ids}
+            return result
+
+        found = {}
+        malformed = False
+        for stock in stocks:
+            # Кривая строка пачки не должна ронять весь ответ
+            try:
+                found[UUID(stock.good_id)] = stock
+            except (ValueError, TypeError, AttributeError):
+                malformed = True
+        # Товар без остатка мог оказаться как раз в кривой строке
+        missing = 'Malformed stock in warehouse response' if malformed else 'Stock not found'
+        for good_id in good_ids:
+            if good_id in found:
+                result.stocks[good_id] = found[good_id]
+            else:
+                result.errors[good_id] = missing
+        return result
+
+    semaphore = asyncio.Semaphore(settings.stock_lookup.concurrency)
+
+    async def lookup(good_id: UUID):
+        async with semaphore:
+            try:
+                response = await warehouse_service.get_stock_by_good_id(good_id)
+                result.stocks[good_id] = Service.decode(response, StockReturn)
+            except Exception as e:
+                result.errors[good_id] = str(e) or type(e).__name__
+
+    async with asyncio.TaskGroup() as tg:
+        for good_id in good_ids:
+            tg.create_task(lookup(good_id))
+
+    return result
 
 
 async def delivery_get_by_order_id(
     order_id: UUID
 ):
-    delivery_service = DeliveryService()
-
     response = await delivery_service.get_delivery(order_id)
 
-    json = response.json()
-
-    return DeliveryReturn.model_validate(json)
+    return Service.decode(response, DeliveryReturn)
 
 
 async def reservation_get_by_order_id(
     order_id: UUID
 ):
-    warehouse_service =  WarehouseService()
-
-    response = WarehouseService.get_reservation_by_order_id(order_id)
-
-    json = response.json()
+    response = await warehouse_service.get_reservation_by_order_id(order_id)
 
-    return ReservationReturn.model_validate(json)
\ No newline at end of file
+    return Service.decode(response, ReservationReturn)
\ No newline at end of file